@@ -1,145 +1,219 @@
 import os
+import gzip
+import hashlib
 import json
+import itertools
+import math
 import time
 import sys
-from datetime import datetime, timedelta
-from flask import Blueprint, render_template, request, jsonify
+from datetime import datetime, timedelta, timezone
+from urllib.parse import parse_qsl, quote, urlencode
+from zlib import crc32
+from flask import Blueprint, Response, abort, make_response, render_template, request, jsonify, stream_with_context, url_for
+from werkzeug.http import is_resource_modified
+
+from .order_ids import OrderIdAllocator
+from .callback_index import SEARCH_FIELDS
+from .lifecycle import LifecycleTracker
+from .persistence import callback_index, callback_store, card_registry, load_callbacks, load_cards, save_callback, save_card, save_orders
+from .profiles import DEFAULT_PROFILE, profile_settings
+from .settings_store import SettingsStore
+from .tester_config import ORDER_COUNTER_FILE, SETTINGS_PATH
 
 tester_bp = Blueprint("tester", __name__, template_folder="templates", static_folder="static")
 
-SETTINGS_PATH = os.path.join(os.path.dirname(__file__), "settings.json")
-CALLBACKS_FILE = os.path.join(os.path.dirname(__file__), "callbacks.json")
-ORDER_COUNTER_FILE = os.path.join(os.path.dirname(__file__), "order_counter.txt")
-CARDS_FILE = os.path.join(os.path.dirname(__file__), "cards.json")
+ORDER_ID_BLOCK_SIZE = 20
+MAX_BATCH_ORDERS = 1000
+PAYMENT_PAGE_URL = "https://lt.pga.gazprombank.ru"
+# Раз в столько секунд поток коллбэков шлет комментарий-пинг, чтобы
+# прокси не закрывали простаивающее соединение
+STREAM_HEARTBEAT = 15
+# Ответы меньше этого размера не сжимаем - выигрыш не окупает gzip
+GZIP_MIN_SIZE = 1024
+# Статика страницы, которая отдается по адресу с хэшем содержимого
+ASSET_FILES = {"tester.css": "text/css"}
+# Такой адрес никогда не меняет содержимое, так что кэшируется на год
+ASSET_MAX_AGE = 365 * 24 * 3600
+
+DEFAULT_SETTINGS = {
+    "amount": 100,
+    "shortDesc": "Короткое описание",
+    "longDesc": "Описание по умолчанию",
+    "backUrlSuccess": "https://tda-photo.ru/success",
+    "backUrlFail": "https://tda-photo.ru/fail",
+    "extraParam": "",
+    "paymentPage": "pages",
+    "cpaExtensions": {},
+    "recurrentEnabled": False,
+    "selectedCardId": "",
+    "cardRegistrationEnabled": False,
+    "aftEnabled": False,
+    "aftMirExtensionType": "3ds2.destAbroadPAN",
+    "aftMirExtensionValue": "BLR411xxxxxxxxx1111"
+}
+
+settings_store = SettingsStore(SETTINGS_PATH, DEFAULT_SETTINGS)
+order_ids = OrderIdAllocator(ORDER_COUNTER_FILE, ORDER_ID_BLOCK_SIZE)
+lifecycle = LifecycleTracker()
+# Идентификатор процесса для ETag: номера версий в памяти у каждого
+# процесса свои и после перезапуска начинаются заново
+PROCESS_TAG = f"{os.getpid():x}.{int(time.time()):x}"
+# endpoint -> (версия, время, когда эта версия впервые отдана)
+_last_modified = {}
+# Собранные один раз ответы: имя файла статики -> CompiledBody и
+# адрес страницы -> CompiledBody оболочки tester.html
+_assets = {}
+_shells = {}
 
 def load_settings():
-    try:
-        with open(SETTINGS_PATH, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception as e:
-        return {
-            "amount": 100,
-            "shortDesc": "Короткое описание",
-            "longDesc": "Описание по умолчанию",
-            "backUrlSuccess": "https://tda-photo.ru/success",
-            "backUrlFail": "https://tda-photo.ru/fail",
-            "extraParam": "",
-            "paymentPage": "pages",
-            "cpaExtensions": {},
-            "recurrentEnabled": False,
-            "selectedCardId": "",
-            "cardRegistrationEnabled": False,
-            "aftEnabled": False,
-            "aftMirExtensionType": "3ds2.destAbroadPAN",
-            "aftMirExtensionValue": "BLR411xxxxxxxxx1111"
-        }
+    # Копия, чтобы изменения в обработчиках не попадали в общий кэш
+    return dict(settings_store.get())
 
 def save_settings(settings):
     try:
-        with open(SETTINGS_PATH, "w", encoding="utf-8") as f:
-            json.dump(settings, f, ensure_ascii=False, indent=4)
+        settings_store.save(settings)
     except Exception as e:
         pass
 
-def load_cards():
-    try:
-        if os.path.exists(CARDS_FILE):
-            with open(CARDS_FILE, "r", encoding="utf-8") as f:
-                cards = json.load(f)
-                return cards[-50:]
-        return []
-    except Exception as e:
-        return []
+def get_next_order_id():
+    return str(order_ids.next_id())
 
-def save_card(card_data):
-    try:
-        if not os.path.exists(CARDS_FILE):
-            with open(CARDS_FILE, "w", encoding="utf-8") as f:
-                json.dump([], f, ensure_ascii=False, indent=2)
-        
-        cards = load_cards()
-        cards = [card for card in cards if card.get("card_id") != card_data.get("card_id")]
-        
-        cards.append({
-            "card_id": card_data.get("card_id"),
-            "masked_pan": card_data.get("masked_pan", ""),
-            "expiry": card_data.get("expiry", ""),
-            "payment_system": card_data.get("payment_system", ""),
-            "timestamp": datetime.now().isoformat(),
-            "registered": card_data.get("registered", "N")
-        })
-        
-        cards = cards[-50:]
-        
-        with open(CARDS_FILE, "w", encoding="utf-8") as f:
-            json.dump(cards, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        pass
+def conditional_response(version, build, per_process=True):
+    """
+    Условный GET для читающих эндпоинтов. version - дешевый признак
+    состояния данных (проверяется без их чтения); если у клиента уже
+    есть ответ этой версии, отдаем 304 и build() не вызываем. Иначе
+    строим ответ, ставим ETag/Last-Modified и сжимаем большой ответ gzip.
+    per_process=False - version не зависит от процесса (хэш содержимого),
+    и ETag совпадает у всех процессов и после перезапуска.
+    """
+    endpoint = request.endpoint
+    known = _last_modified.get(endpoint)
+    if known is None or known[0] != version:
+        known = (version, datetime.now(timezone.utc).replace(microsecond=0))
+        _last_modified[endpoint] = known
+    last_modified = known[1]
+    etag = f"{crc32(repr((version, request.query_string)).encode()):08x}"
+    if per_process:
+        etag = f"{PROCESS_TAG}-{etag}"
 
-def get_next_order_id():
-    try:
-        if os.path.exists(ORDER_COUNTER_FILE):
-            with open(ORDER_COUNTER_FILE, "r") as f:
-                counter = int(f.read().strip())
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = make_response("", 304)
+    else:
+        response = make_response(build())
+        body = response.get_data()
+        if len(body) >= GZIP_MIN_SIZE and request.accept_encodings["gzip"] \
+                and "Content-Encoding" not in response.headers:
+            response.set_data(gzip.compress(body, compresslevel=5))
+            response.headers["Content-Encoding"] = "gzip"
+    response.set_etag(etag, weak=True)
+    response.last_modified = last_modified
+    # Браузер хранит ответ, но перед использованием всегда сверяется с сервером
+    response.headers["Cache-Control"] = "no-cache"
+    response.vary.add("Accept-Encoding")
+    return response
+
+class CompiledBody:
+    """Тело ответа, подготовленное один раз: текст, его gzip и хэш содержимого."""
+    def __init__(self, body, mimetype):
+        self.body = body
+        self.mimetype = mimetype
+        self.gzipped = gzip.compress(body, compresslevel=9)
+        self.digest = hashlib.sha256(body).hexdigest()[:16]
+
+    def response(self):
+        if request.accept_encodings["gzip"]:
+            response = Response(self.gzipped, mimetype=self.mimetype)
+            response.headers["Content-Encoding"] = "gzip"
         else:
-            counter = 0
-    except:
-        counter = 0
-    
-    counter += 1
-    
-    try:
-        with open(ORDER_COUNTER_FILE, "w") as f:
-            f.write(str(counter))
-    except Exception as e:
-        pass
-    
-    return str(counter)
+            response = Response(self.body, mimetype=self.mimetype)
+        response.vary.add("Accept-Encoding")
+        return response
 
-def load_callbacks():
-    if os.path.exists(CALLBACKS_FILE):
-        try:
-            with open(CALLBACKS_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except:
-            return []
-    return []
+def compiled_asset(filename):
+    asset = _assets.get(filename)
+    if asset is None:
+        with open(os.path.join(tester_bp.static_folder, filename), "rb") as f:
+            asset = _assets[filename] = CompiledBody(f.read(), ASSET_FILES[filename])
+    return asset
 
-def save_callback(token, data):
-    try:
-        callbacks = load_callbacks()
-        callbacks = [cb for cb in callbacks if cb["token"] != token]
-        
-        callbacks.append({
-            "token": token,
-            "timestamp": datetime.now().isoformat(),
-            "data": data
-        })
-        callbacks = callbacks[-50:]
-        with open(CALLBACKS_FILE, "w", encoding="utf-8") as f:
-            json.dump(callbacks, f, ensure_ascii=False, indent=2)
-            
-        if data.get("type") == "RPReq":
-            raw_params = data.get("raw_params", {})
-            card_id = raw_params.get("card.id")
-            
-            if card_id:
-                card_data = {
-                    "card_id": card_id,
-                    "masked_pan": raw_params.get("p.maskedPan", ""),
-                    "expiry": raw_params.get("card.expiry", ""),
-                    "payment_system": raw_params.get("p.paymentSystem", ""),
-                    "registered": raw_params.get("card.registered", "N")
-                }
-                save_card(card_data)
-    except Exception as e:
-        pass
+def asset_url(filename):
+    """Адрес файла статики с хэшем содержимого."""
+    return url_for("tester.asset", digest=compiled_asset(filename).digest, filename=filename)
+
+@tester_bp.route("/assets/<digest>/<filename>")
+def asset(digest, filename):
+    if filename not in ASSET_FILES:
+        abort(404)
+    compiled = compiled_asset(filename)
+    response = compiled.response()
+    if digest == compiled.digest:
+        response.headers["Cache-Control"] = f"public, max-age={ASSET_MAX_AGE}, immutable"
+    else:
+        # Ссылка со страницы прошлой версии: отдаем текущий файл без долгого кэша
+        response.headers["Cache-Control"] = "no-cache"
+    return response
 
 @tester_bp.route("/")
 def index():
-    settings = load_settings()
-    cards = load_cards()
-    return render_template("tester.html", settings=settings, cards=cards)
+    # Страница - неизменная оболочка: собирается один раз на процесс, а
+    # настройки и карты подгружает сама через get_settings и get_cards
+    key = request.script_root + request.path
+    shell = _shells.get(key)
+    if shell is None:
+        html = render_template("tester.html", asset_url=asset_url)
+        shell = _shells[key] = CompiledBody(html.encode("utf-8"), "text/html")
+    return conditional_response(shell.digest, shell.response, per_process=False)
+
+@tester_bp.route("/get_settings", methods=["GET"])
+def get_settings():
+    settings, version = settings_store.snapshot()
+    return conditional_response(version, lambda: jsonify({"success": True, "settings": settings}))
+
+def build_initiation_link(settings, order_id, data):
+    """
+    Собирает ссылку на платежную страницу. Параметры кодируются через
+    urlencode, а не склеиваются строкой.
+    """
+    mode = data.get("mode", "test")
+    extra_param = data.get("extraParam", "")
+    payment_page = data.get("paymentPage", "pages")
+    recurrent_enabled = data.get("recurrentEnabled", False)
+    selected_card_id = data.get("selectedCardId", "")
+    card_registration_enabled = data.get("cardRegistrationEnabled", False)
+    aft_enabled = data.get("aftEnabled", False)
+
+    # Если включена регистрация карт, используем pages-rec
+    if card_registration_enabled:
+        payment_page = "pages-rec"
+
+    params = [
+        ("lang_code", "RU"),
+        ("merch_id", "ECOM_CPA"),
+        ("back_url_s", settings.get("backUrlSuccess", "")),
+        ("back_url_f", settings.get("backUrlFail", "")),
+        ("o.order_id", order_id),
+        ("mode", mode),
+        ("amount", settings.get("amount", 100))
+    ]
+
+    # По o.profile шлюз выберет настройки этого профиля для CPAReq
+    if data.get("profile"):
+        params.append(("o.profile", data["profile"]))
+
+    if extra_param:
+        params.extend(parse_qsl(extra_param, keep_blank_values=True))
+
+    # Если включен AFT платеж, добавляем paymentId=aft
+    if aft_enabled:
+        params.append(("paymentId", "aft"))
+
+    if recurrent_enabled and selected_card_id:
+        params.append(("src.type", "card_id"))
+        params.append(("src.cardId", selected_card_id))
+
+    query = urlencode(params, quote_via=quote, safe=":/")
+    return f"{PAYMENT_PAGE_URL}/{quote(payment_page)}/?{query}"
 
 @tester_bp.route("/create_order", methods=["POST"])
 def create_order():
@@ -149,61 +223,87 @@ def create_order():
         
         if not data:
             return jsonify({"success": False, "error": "No JSON data"})
-            
-        mode = data.get("mode", "test")
-        extra_param = data.get("extraParam", "")
-        payment_page = data.get("paymentPage", "pages")
-        recurrent_enabled = data.get("recurrentEnabled", False)
-        selected_card_id = data.get("selectedCardId", "")
-        card_registration_enabled = data.get("cardRegistrationEnabled", False)
-        aft_enabled = data.get("aftEnabled", False)
-        aft_mir_extension_type = data.get("aftMirExtensionType", "")
-        aft_mir_extension_value = data.get("aftMirExtensionValue", "")
         
+        if data.get("profile"):
+            settings = profile_settings(settings, data["profile"])
         order_id = get_next_order_id()
-        amount = settings.get("amount", 100)
-        
-        # Если включена регистрация карт, используем pages-rec
-        if card_registration_enabled:
-            payment_page = "pages-rec"
-        
-        # Если включен AFT платеж, добавляем paymentId=aft
-        if aft_enabled:
-            if extra_param:
-                extra_param += "&paymentId=aft"
-            else:
-                extra_param = "paymentId=aft"
-        
-        initiation_link = (
-            f"https://lt.pga.gazprombank.ru/{payment_page}/?"
-            f"lang_code=RU&merch_id=ECOM_CPA&back_url_s={settings.get('backUrlSuccess', '')}"
-            f"&back_url_f={settings.get('backUrlFail', '')}&o.order_id={order_id}&mode={mode}&amount={amount}"
-        )
-        
-        if extra_param:
-            initiation_link += f"&{extra_param}"
-            
-        if recurrent_enabled and selected_card_id:
-            initiation_link += f"&src.type=card_id&src.cardId={selected_card_id}"
+        initiation_link = build_initiation_link(settings, order_id, data)
+        save_orders([order_id])
         
         return jsonify({
             "initiation_link": initiation_link, 
             "success": True,
             "order_id": order_id,
-            "aft_enabled": aft_enabled,
-            "aft_mir_extension_type": aft_mir_extension_type,
-            "aft_mir_extension_value": aft_mir_extension_value
+            "aft_enabled": data.get("aftEnabled", False),
+            "aft_mir_extension_type": data.get("aftMirExtensionType", ""),
+            "aft_mir_extension_value": data.get("aftMirExtensionValue", "")
         })
         
     except Exception as e:
         return jsonify({"success": False, "error": str(e)})
 
+@tester_bp.route("/create_orders", methods=["POST"])
+def create_orders():
+    """
+    Пакетное создание заказов для регрессионных прогонов.
+
+    Тело: {"base": {...}, "matrix": {"mode": ["test", "prod"], ...}, "repeat": 1}.
+    base - те же поля, что у /create_order; matrix - списки значений, по
+    декартову произведению которых создаются заказы. Номера заказов
+    резервируются одним непрерывным блоком, ссылки отдаются потоком NDJSON.
+    """
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({"success": False, "error": "No JSON data"})
+
+    base = data.get("base", {})
+    matrix = data.get("matrix", {})
+    repeat = data.get("repeat", 1)
+    if not isinstance(base, dict) or not isinstance(matrix, dict) or not isinstance(repeat, int) or repeat < 1:
+        return jsonify({"success": False, "error": "Invalid batch parameters"})
+    if not all(isinstance(values, list) and values for values in matrix.values()):
+        return jsonify({"success": False, "error": "Matrix values must be non-empty lists"})
+
+    keys = list(matrix)
+    # Размер пакета считается до построения комбинаций, иначе большая
+    # матрица успеет занять память еще до проверки лимита
+    total = math.prod(len(matrix[key]) for key in keys) * repeat
+    if total > MAX_BATCH_ORDERS:
+        return jsonify({"success": False, "error": f"Batch is limited to {MAX_BATCH_ORDERS} orders"}), 400
+
+    settings = load_settings()
+    order_range = order_ids.reserve(total)
+    # Весь блок отмечается созданным одной транзакцией до отдачи ссылок
+    save_orders(order_range)
+
+    def generate():
+        combinations = itertools.chain.from_iterable(
+            itertools.product(*(matrix[key] for key in keys)) for _ in range(repeat)
+        )
+        for order_id, values in zip(order_range, combinations):
+            combo = dict(zip(keys, values))
+            order_data = {**base, **combo}
+            initiation_link = build_initiation_link(
+                profile_settings(settings, order_data.get("profile") or DEFAULT_PROFILE),
+                str(order_id), order_data
+            )
+            yield json.dumps({
+                "order_id": str(order_id),
+                "initiation_link": initiation_link,
+                "params": combo
+            }, ensure_ascii=False) + "\n"
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
 @tester_bp.route("/save_settings", methods=["POST"])
 def save_settings_route():
     data = request.get_json()
-    settings = load_settings()
+    stored = load_settings()
+    # Без profile сохраняется профиль по умолчанию (верхний уровень файла)
+    profile = data.get("profile") or DEFAULT_PROFILE
+    settings = profile_settings(stored, profile)
     
-    settings.update({
+    updates = {
         "amount": data.get("amount", settings.get("amount", 100)),
         "shortDesc": data.get("shortDesc", settings.get("shortDesc", "Короткое описание")),
         "longDesc": data.get("longDesc", settings.get("longDesc", "Описание по умолчанию")),
@@ -217,32 +317,154 @@ def save_settings_route():
         "aftEnabled": data.get("aftEnabled", False),
         "aftMirExtensionType": data.get("aftMirExtensionType", "3ds2.destAbroadPAN"),
         "aftMirExtensionValue": data.get("aftMirExtensionValue", "")
-    })
+    }
     
     cpa_extensions = data.get("cpaExtensions", {})
     if isinstance(cpa_extensions, dict):
-        settings["cpaExtensions"] = cpa_extensions
+        updates["cpaExtensions"] = cpa_extensions
     else:
-        settings["cpaExtensions"] = {}
+        updates["cpaExtensions"] = {}
     
-    save_settings(settings)
+    if profile == DEFAULT_PROFILE:
+        stored.update(updates)
+    else:
+        profiles = dict(stored.get("profiles", {}))
+        profiles[profile] = {**profiles.get(profile, {}), **updates}
+        stored["profiles"] = profiles
+    
+    save_settings(stored)
     return jsonify({"success": True})
 
+@tester_bp.route("/profiles", methods=["GET", "POST"])
+def profiles_route():
+    """
+    GET - имена профилей и правила выбора профиля на шлюзе.
+    POST {"routing": {...}} заменяет правила, {"delete": "имя"} удаляет профиль.
+    """
+    settings = load_settings()
+    if request.method == "POST":
+        data = request.get_json(silent=True) or {}
+        if isinstance(data.get("routing"), dict):
+            settings["profileRouting"] = data["routing"]
+        if data.get("delete"):
+            settings["profiles"] = {name: overrides for name, overrides in settings.get("profiles", {}).items()
+                                    if name != data["delete"]}
+        save_settings(settings)
+    return jsonify({
+        "success": True,
+        "profiles": [DEFAULT_PROFILE] + list(settings.get("profiles", {})),
+        "routing": settings.get("profileRouting", {})
+    })
+
 @tester_bp.route("/get_callbacks", methods=["GET"])
 def get_callbacks():
-    callbacks = load_callbacks()
-    return jsonify({"success": True, "callbacks": callbacks})
+    since = request.args.get("since", type=int)
+
+    def build():
+        if since is None:
+            callbacks = load_callbacks()
+        else:
+            callbacks = callback_store.since(since)
+        return jsonify({"success": True, "callbacks": callbacks, "cursor": callback_store.last_seq()})
+
+    return conditional_response(callback_store.version(), build)
+
+def callback_summary(callback):
+    # В поток уходит только то, что нужно для списка; полные raw_params
+    # по-прежнему отдает get_callback_details
+    data = callback.get("data", {})
+    return {
+        "seq": callback.get("seq"),
+        "token": callback.get("token"),
+        "timestamp": callback.get("timestamp"),
+        "data": {
+            "type": data.get("type"),
+            "result_code": data.get("raw_params", {}).get("result_code")
+        }
+    }
+
+@tester_bp.route("/callbacks/stream", methods=["GET"])
+def callbacks_stream():
+    cursor = request.args.get("since", type=int)
+    if cursor is None:
+        cursor = request.headers.get("Last-Event-ID", type=int)
+    if cursor is None:
+        cursor = callback_store.last_seq()
+
+    def generate(cursor):
+        # Журнал пересоздан - курсор клиента больше не имеет смысла
+        if cursor > callback_store.last_seq():
+            cursor = 0
+        yield "retry: 2000\n\n"
+        while True:
+            if not callback_store.wait(cursor, STREAM_HEARTBEAT):
+                yield ": ping\n\n"
+                continue
+            for callback in callback_store.since(cursor):
+                cursor = callback["seq"]
+                payload = json.dumps(callback_summary(callback), ensure_ascii=False)
+                yield f"id: {cursor}\nevent: callback\ndata: {payload}\n\n"
+
+    return Response(
+        stream_with_context(generate(cursor)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@tester_bp.route("/callbacks/search", methods=["GET"])
+def search_callbacks():
+    filters = {name: request.args[name] for name in SEARCH_FIELDS if request.args.get(name)}
+    try:
+        callbacks, cursor = callback_index.search(
+            filters,
+            since=request.args.get("since"),
+            until=request.args.get("until"),
+            cursor=request.args.get("cursor", type=int),
+            limit=request.args.get("limit", type=int)
+        )
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+    return jsonify({"success": True, "callbacks": callbacks, "next_cursor": cursor})
+
+@tester_bp.route("/stats", methods=["GET"])
+def stats():
+    # Догоняем индекс: коллбэки пишет api_server в своем процессе
+    try:
+        lifecycle.sync(callback_index)
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+    return jsonify({"success": True, "stats": lifecycle.stats()})
 
 @tester_bp.route("/get_callback_details", methods=["GET"])
 def get_callback_details():
     token = request.args.get("token")
-    callbacks = load_callbacks()
-    for callback in callbacks:
-        if callback["token"] == token:
-            return jsonify({"success": True, "data": callback["data"]})
+    callback = callback_store.get(token)
+    if callback is None:
+        # Вне окна журнала коллбэк еще может быть в поисковом индексе
+        try:
+            callback = callback_index.get(token)
+        except Exception as e:
+            pass
+    if callback is not None:
+        return jsonify({"success": True, "data": callback["data"]})
     return jsonify({"success": False, "error": "Callback not found"})
 
 @tester_bp.route("/get_cards", methods=["GET"])
 def get_cards():
-    cards = load_cards()
-    return jsonify({"success": True, "cards": cards})
+    card_id = request.args.get("card_id")
+    pan_prefix = request.args.get("pan_prefix")
+    payment_system = request.args.get("payment_system")
+
+    def build():
+        if card_id:
+            card = card_registry.get(card_id)
+            cards = [card] if card else []
+        elif pan_prefix:
+            cards = card_registry.by_pan_prefix(pan_prefix)
+        elif payment_system:
+            cards = card_registry.by_payment_system(payment_system)
+        else:
+            cards = load_cards()
+        return jsonify({"success": True, "cards": cards})
+
+    return conditional_response(card_registry.version(), build)
@@ -0,0 +1,327 @@
+"""
+Получатели AFT-переводов: номер карты (PAN), IBAN и SWIFT.
+
+Значение aftMirExtensionValue может начинаться с кода страны получателя
+(BLR4111..., BLRBY86AKBB...), а к SWIFT иногда приписан телефон.
+normalize_value_for_type разбирает одно значение для mir-extension;
+normalize_many/validate_many делают то же для целых списков фикстур за
+один проход и заодно проверяют значения:
+
+    PAN   - 12-19 цифр и контрольная сумма Луна; маскированный номер
+            (411111******1111) проверяется только по структуре
+    IBAN  - формат, длина по таблице страны и контрольная сумма mod 97
+    SWIFT - формат BIC, известная страна в 5-6 символах, телефон E.164;
+            код филиала из цифр вплотную к телефону - ошибка, потому
+            что normalize_value_for_type отрезает его вместе с цифрами
+
+Проверяется то, что на самом деле уйдет в mir-extension: префикс страны
+снимается только по таблицам PAN_PREFIX_COUNTRIES и IBAN_PREFIX_COUNTRIES,
+с SWIFT не снимается вовсе, а снятый с IBAN префикс должен совпадать со
+страной IBAN. generate() строит заведомо корректные синтетические значения.
+
+    python aft_destinations.py generate pan 100000 --country BLR > pans.txt
+    python aft_destinations.py validate iban ibans.txt
+    python aft_destinations.py bench --count 1000000
+"""
+import argparse
+import random
+import re
+import sys
+import time
+from collections import Counter
+
+PAN_TYPE = "3ds2.destAbroadPAN"
+IBAN_TYPE = "3ds2.destAbroadIBAN"
+SWIFT_TYPE = "3ds2.destAbroadSWIFT"
+TYPES = {"pan": PAN_TYPE, "iban": IBAN_TYPE, "swift": SWIFT_TYPE}
+
+# Коды стран (ISO 3166 alpha-3 -> alpha-2), которые встречаются в префиксе значения
+COUNTRIES = {
+    "ARE": "AE", "ARM": "AM", "AUT": "AT", "AZE": "AZ", "BEL": "BE", "BLR": "BY",
+    "CHE": "CH", "CHN": "CN", "CYP": "CY", "CZE": "CZ", "DEU": "DE", "DNK": "DK",
+    "ESP": "ES", "EST": "EE", "FIN": "FI", "FRA": "FR", "GBR": "GB", "GEO": "GE",
+    "GRC": "GR", "HUN": "HU", "IND": "IN", "IRL": "IE", "ISR": "IL", "ITA": "IT",
+    "KAZ": "KZ", "KGZ": "KG", "LTU": "LT", "LVA": "LV", "MDA": "MD", "MNG": "MN",
+    "NLD": "NL", "NOR": "NO", "POL": "PL", "PRT": "PT", "ROU": "RO", "RUS": "RU",
+    "SAU": "SA", "SRB": "RS", "SWE": "SE", "TJK": "TJ", "TUR": "TR", "UKR": "UA",
+    "USA": "US", "UZB": "UZ", "VNM": "VN"
+}
+ALPHA2 = frozenset(COUNTRIES.values())
+
+# Длина IBAN по стране; в странах вне таблицы IBAN не используется
+IBAN_LENGTHS = {
+    "AE": 23, "AT": 20, "AZ": 28, "BE": 16, "BY": 28, "CH": 21, "CY": 28, "CZ": 24,
+    "DE": 22, "DK": 18, "EE": 20, "ES": 24, "FI": 18, "FR": 27, "GB": 22, "GE": 22,
+    "GR": 27, "HU": 28, "IE": 22, "IL": 23, "IT": 27, "KZ": 20, "LT": 20, "LV": 21,
+    "MD": 24, "NL": 18, "NO": 15, "PL": 28, "PT": 25, "RO": 24, "RS": 22, "RU": 33,
+    "SA": 24, "SE": 24, "TR": 26, "UA": 29
+}
+
+# Коды стран, которые normalize_value_for_type снимает с начала значения.
+# С SWIFT префикс не снимается: страна задается отдельной настройкой
+PAN_PREFIX_COUNTRIES = ("BLR", "RUS")
+IBAN_PREFIX_COUNTRIES = ("BLR", "RUS", "KAZ", "UKR", "DEU", "USA", "GBR", "CHN")
+PAN_COUNTRY_PATTERN = re.compile(r'^(?:' + "|".join(PAN_PREFIX_COUNTRIES) + ')', re.IGNORECASE)
+IBAN_COUNTRY_PATTERN = re.compile(r'^(?:' + "|".join(IBAN_PREFIX_COUNTRIES) + ')')
+SWIFT_PATTERN = re.compile(r'^([A-Z]{6}[A-Z0-9]{2}([A-Z0-9]{3})?)')
+
+# Любой известный код страны в начале значения - для понятных ошибок
+COUNTRY_PREFIX_PATTERN = re.compile(r'^(' + "|".join(COUNTRIES) + ')')
+PAN_PATTERN = re.compile(r'^[0-9]{12,19}$')
+MASKED_PAN_PATTERN = re.compile(r'^[0-9]{1,8}[*xX]+[0-9]{2,4}$')
+IBAN_PATTERN = re.compile(r'^([A-Z]{2})[0-9]{2}[A-Z0-9]{11,30}$')
+BIC_PATTERN = re.compile(r'^[A-Z]{4}([A-Z]{2})[A-Z0-9]{2}(?:[A-Z0-9]{3})?$')
+# Телефон может быть записан с пробелами, дефисами и скобками: шлюз
+# перед отправкой оставляет в нем только цифры (NON_DIGITS_PATTERN)
+PHONE_PATTERN = re.compile(r'^\+?[0-9 ()\-.]+$')
+NON_DIGITS_PATTERN = re.compile(r'\D')
+
+# Удвоенная цифра для алгоритма Луна и буквы IBAN -> числа 10..35
+_LUHN_DOUBLE = str.maketrans("0123456789", "0246813579")
+_IBAN_DIGITS = str.maketrans({chr(ord("A") + i): str(10 + i) for i in range(26)})
+
+def normalize_value_for_type(value, extension_type, country):
+    """
+    Нормализует значение в зависимости от типа расширения.
+    Возвращает кортеж (value, phone)
+    """
+    if not value:
+        return value, ""
+
+    value = str(value).strip()
+
+    # Для PAN: номер карты, может быть замаскирован; снимаем префикс страны
+    if extension_type == PAN_TYPE:
+        return (value[3:] if PAN_COUNTRY_PATTERN.match(value) else value), ""
+
+    # Для IBAN: удаляем код страны из начала если он там
+    if extension_type == IBAN_TYPE:
+        return (value[3:] if IBAN_COUNTRY_PATTERN.match(value) else value), ""
+
+    # Для SWIFT: нужно отделить SWIFT код от телефона если они вместе
+    if extension_type == SWIFT_TYPE:
+        # SWIFT код обычно 8 или 11 символов (буквы/цифры)
+        match = SWIFT_PATTERN.match(value)
+        if match:
+            swift_code = match.group(1)
+            # Остаток может быть телефоном
+            return swift_code, value[len(swift_code):].strip()
+        # Если не соответствует паттерну SWIFT, возвращаем как есть
+        return value, ""
+
+    return value, ""
+
+def normalize_many(values, extension_type):
+    """normalize_value_for_type для списка значений: [(value, phone)]."""
+    return [normalize_value_for_type(value, extension_type, None) for value in values]
+
+def luhn_valid(digits):
+    # С конца: нечетные позиции как есть, четные удваиваются
+    return (sum(map(int, digits[-1::-2])) + sum(map(int, digits[-2::-2].translate(_LUHN_DOUBLE)))) % 10 == 0
+
+def luhn_digit(payload):
+    """Контрольная цифра Луна, которую нужно дописать к payload."""
+    total = sum(map(int, payload[::-2].translate(_LUHN_DOUBLE))) + sum(map(int, payload[-2::-2]))
+    return str(-total % 10)
+
+def iban_valid(iban):
+    return int((iban[4:] + iban[:4]).translate(_IBAN_DIGITS)) % 97 == 1
+
+def iban_check_digits(country, bban):
+    return f"{98 - int((bban + country + '00').translate(_IBAN_DIGITS)) % 97:02d}"
+
+def _unstripped_prefix(value, kind):
+    match = COUNTRY_PREFIX_PATTERN.match(value)
+    if match:
+        return f"country prefix {match.group(1)} is not stripped from {kind} values"
+    return None
+
+def _check_pan(value, normalized, phone):
+    if PAN_PATTERN.match(normalized):
+        return normalized, phone, None if luhn_valid(normalized) else "PAN checksum mismatch"
+    if MASKED_PAN_PATTERN.match(normalized) and 12 <= len(normalized) <= 19:
+        return normalized, phone, None
+    return normalized, phone, _unstripped_prefix(normalized, "PAN") or "PAN must be 12-19 digits"
+
+def _check_iban(value, normalized, phone):
+    match = IBAN_PATTERN.match(normalized)
+    if not match:
+        return normalized, phone, _unstripped_prefix(normalized, "IBAN") or "bad IBAN format"
+    code = match.group(1)
+    if code not in IBAN_LENGTHS:
+        return normalized, phone, f"IBAN is not used in {code}"
+    if len(normalized) != IBAN_LENGTHS[code]:
+        return normalized, phone, f"IBAN for {code} must be {IBAN_LENGTHS[code]} characters"
+    # Снятый префикс страны должен совпадать со страной IBAN
+    if normalized != value and COUNTRIES[value[:3]] != code:
+        return normalized, phone, f"IBAN country {code} does not match {value[:3]}"
+    if not iban_valid(normalized):
+        return normalized, phone, "IBAN checksum mismatch"
+    return normalized, phone, None
+
+def _check_swift(value, normalized, phone):
+    match = SWIFT_PATTERN.match(value)
+    if not match:
+        return normalized, phone, "bad SWIFT format"
+    # normalize_value_for_type берет в код филиала три первые цифры телефона
+    if match.group(2) and match.group(2).isdigit() and value[len(normalized):][:1].isdigit():
+        return normalized, phone, "SWIFT branch and phone run together, separate them with a space"
+    bic = BIC_PATTERN.match(normalized)
+    if not bic or bic.group(1) not in ALPHA2:
+        # BLRALFABY2X...: без префикса страны это был бы корректный BIC
+        prefixed = COUNTRY_PREFIX_PATTERN.match(value) and SWIFT_PATTERN.match(value[3:])
+        if prefixed and BIC_PATTERN.match(prefixed.group(1)):
+            return normalized, phone, _unstripped_prefix(value, "SWIFT")
+        return normalized, phone, f"unknown SWIFT country {normalized[4:6]}"
+    if phone and not (PHONE_PATTERN.match(phone) and 7 <= len(NON_DIGITS_PATTERN.sub('', phone)) <= 15):
+        return normalized, phone, "bad phone"
+    return normalized, phone, None
+
+_CHECKS = {PAN_TYPE: _check_pan, IBAN_TYPE: _check_iban, SWIFT_TYPE: _check_swift}
+
+def validate_many(values, extension_type):
+    """
+    Проверяет список значений одного типа. Возвращает [(value, phone,
+    ошибка)]: значение и телефон в том виде, в каком они уйдут в
+    mir-extension (normalize_value_for_type), и ошибку или None.
+    """
+    check = _CHECKS[extension_type]
+    results = []
+    for value in values:
+        value = str(value).strip()
+        normalized, phone = normalize_value_for_type(value, extension_type, None)
+        results.append(check(value, normalized, phone))
+    return results
+
+# Первые цифры номеров карт по платежным системам
+PAN_PREFIXES = {"MIR": ("2200", "2201", "2202", "2204"), "VISA": ("4",),
+                "MC": ("51", "52", "53", "54", "55", "2221", "2720")}
+
+def generate_pans(count, rng, payment_system=None, length=16):
+    systems = [payment_system] if payment_system else list(PAN_PREFIXES)
+    digits = "0123456789"
+    pans = []
+    for _ in range(count):
+        prefix = rng.choice(PAN_PREFIXES[rng.choice(systems)])
+        payload = prefix + "".join(rng.choices(digits, k=length - len(prefix) - 1))
+        pans.append(payload + luhn_digit(payload))
+    return pans
+
+def generate_ibans(count, rng, alpha2=None):
+    codes = [alpha2] if alpha2 else list(IBAN_LENGTHS)
+    alnum = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    ibans = []
+    for _ in range(count):
+        code = rng.choice(codes)
+        # Код банка буквами, как у большинства стран, дальше цифры счета
+        bban = "".join(rng.choices(alnum[10:], k=4)) + "".join(rng.choices(alnum[:10], k=IBAN_LENGTHS[code] - 8))
+        ibans.append(code + iban_check_digits(code, bban) + bban)
+    return ibans
+
+def generate_swifts(count, rng, alpha2=None, phone=True):
+    codes = [alpha2] if alpha2 else sorted(ALPHA2)
+    letters = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    alnum = letters + "0123456789"
+    swifts = []
+    for _ in range(count):
+        code = "".join(rng.choices(letters, k=4)) + rng.choice(codes) + "".join(rng.choices(alnum, k=2))
+        branch = rng.random() < 0.5
+        if branch:
+            # Код филиала с буквы, чтобы не сливаться с цифрами телефона
+            code += rng.choice(letters) + "".join(rng.choices(alnum, k=2))
+        if phone:
+            # После 8-символьного кода телефон отделяется пробелом
+            code += ("" if branch else " ") + "".join(rng.choices("0123456789", k=rng.randint(9, 12)))
+        swifts.append(code)
+    return swifts
+
+def generate(extension_type, count, country=None, seed=None):
+    """
+    count корректных синтетических значений. country - код страны
+    (alpha-3): IBAN и SWIFT берутся из этой страны, а PAN и IBAN еще и
+    получают его префиксом (только из тех, что снимает шлюз).
+    """
+    prefixes = {PAN_TYPE: PAN_PREFIX_COUNTRIES, IBAN_TYPE: IBAN_PREFIX_COUNTRIES}.get(extension_type, ())
+    if country and extension_type != SWIFT_TYPE and country not in prefixes:
+        raise ValueError(f"country prefix {country} is not stripped from {extension_type} values")
+    rng = random.Random(seed)
+    alpha2 = COUNTRIES[country] if country else None
+    if extension_type == PAN_TYPE:
+        values = generate_pans(count, rng)
+    elif extension_type == IBAN_TYPE:
+        values = generate_ibans(count, rng, alpha2)
+    else:
+        values = generate_swifts(count, rng, alpha2)
+    if country and extension_type != SWIFT_TYPE:
+        values = [country + value for value in values]
+    return values
+
+def _read_values(path):
+    with (sys.stdin if path == "-" else open(path, "r", encoding="utf-8")) as f:
+        return [line.strip() for line in f if line.strip()]
+
+def bench(count, seed):
+    """Замер генерации, нормализации и проверки count значений."""
+    print(f"{'type':<8}{'values':>10}{'generate/s':>14}{'normalize/s':>14}{'validate/s':>14}{'errors':>8}")
+    for i, (name, extension_type) in enumerate(TYPES.items()):
+        # count делится между типами поровну, остаток - первым
+        per_type = count // len(TYPES) + (1 if i < count % len(TYPES) else 0)
+        started = time.perf_counter()
+        values = generate(extension_type, per_type, "BLR", seed)
+        generated = time.perf_counter() - started
+
+        started = time.perf_counter()
+        normalize_many(values, extension_type)
+        normalized = time.perf_counter() - started
+
+        started = time.perf_counter()
+        results = validate_many(values, extension_type)
+        validated = time.perf_counter() - started
+        errors = sum(1 for result in results if result[2] is not None)
+        print(f"{name:<8}{per_type:>10}{per_type / generated:>14.0f}{per_type / normalized:>14.0f}"
+              f"{per_type / validated:>14.0f}{errors:>8}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Фикстуры получателей AFT: генерация, проверка, замер")
+    commands = parser.add_subparsers(dest="command", required=True)
+    gen = commands.add_parser("generate", help="синтетические корректные значения, по одному на строку")
+    gen.add_argument("type", choices=sorted(TYPES))
+    gen.add_argument("count", type=int)
+    gen.add_argument("--country", choices=sorted(COUNTRIES), help="префикс страны (alpha-3)")
+    gen.add_argument("--seed", type=int)
+    check = commands.add_parser("validate", help="проверка файла со значениями (- для stdin)")
+    check.add_argument("type", choices=sorted(TYPES))
+    check.add_argument("path")
+    check.add_argument("--show", type=int, default=10, help="сколько ошибочных значений показать")
+    benchmark = commands.add_parser("bench", help="замер на синтетических значениях")
+    benchmark.add_argument("--count", type=int, default=1000000)
+    benchmark.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    if args.command == "generate":
+        try:
+            values = generate(TYPES[args.type], args.count, args.country, args.seed)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 2
+        sys.stdout.write("\n".join(values) + "\n")
+        return 0
+    if args.command == "bench":
+        bench(args.count, args.seed)
+        return 0
+
+    values = _read_values(args.path)
+    results = validate_many(values, TYPES[args.type])
+    errors = Counter(error for _, _, error in results if error is not None)
+    shown = 0
+    for value, (_, _, error) in zip(values, results):
+        if error is not None and shown < args.show:
+            print(f"{value}: {error}", file=sys.stderr)
+            shown += 1
+    print(f"{len(values) - sum(errors.values())} of {len(values)} values are valid")
+    for error, count in errors.most_common():
+        print(f"{count:>10}  {error}")
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
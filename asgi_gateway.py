@@ -0,0 +1,178 @@
+"""
+Асинхронный вариант шлюза CPA/RP для ASGI-сервера.
+
+Отвечает на те же /operation/check, /operation/callback и /ping, что и
+api_server, и собирает ответы теми же функциями. Разница в сохранении
+коллбэков: запись ставится в ограниченную очередь, а на диск ее пишет
+фоновая задача, так что ответ банку не ждет файловую систему.
+
+Если очередь заполнена, запрос ждет свободного места - это и есть
+обратное давление на банк, вместо неограниченного роста памяти. При
+остановке сервера (lifespan shutdown) очередь дописывается до конца.
+Пишет очередь свой единственный поток, а не общий пул цикла событий:
+иначе запросы, занявшие пул, могли бы остановить запись, которую сами
+ждут. Повторы банка ждут ответа первого запроса тоже без потоков.
+
+    uvicorn asgi_gateway:app --host 0.0.0.0 --port 7443
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import parse_qsl
+
+import api_server
+import gateway_logging
+import metrics
+from idempotency import PENDING_TIMEOUT
+
+CALLBACK_QUEUE_SIZE = int(os.environ.get("GATEWAY_CALLBACK_QUEUE_SIZE", "1000"))
+# Как часто повтор проверяет, готов ли ответ первого запроса, в секундах
+PENDING_POLL_INTERVAL = 0.005
+
+log = logging.getLogger("asgi_gateway")
+
+class CallbackWriter:
+    """Фоновая запись коллбэков из ограниченной очереди."""
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.queue = None
+        self._task = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="callback-writer")
+
+    async def start(self):
+        self.queue = asyncio.Queue(self.maxsize)
+        self._task = asyncio.get_running_loop().create_task(self._drain())
+
+    async def submit(self, token, record):
+        # Сервер без поддержки lifespan: запускаемся при первом коллбэке
+        if self.queue is None:
+            await self.start()
+        # Ждет, если очередь заполнена
+        await self.queue.put((token, record))
+
+    async def _drain(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            # Забираем все, что накопилось, и пишем одним заходом в поток записи
+            while not self.queue.empty() and len(batch) < self.maxsize:
+                batch.append(self.queue.get_nowait())
+            try:
+                await loop.run_in_executor(self._executor, self._persist, batch)
+            except Exception as e:
+                log.warning("Error persisting callbacks batch: %s", e)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _persist(self, batch):
+        api_server.persist_callbacks(batch)
+
+    async def stop(self):
+        if self.queue is None:
+            return
+        await self.queue.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+callback_writer = CallbackWriter(CALLBACK_QUEUE_SIZE)
+
+def query_params(scope):
+    # Как и request.args во Flask, берем первое значение каждого параметра
+    params = {}
+    for key, value in parse_qsl(scope.get("query_string", b"").decode("utf-8", "replace"), keep_blank_values=True):
+        params.setdefault(key, value)
+    return params
+
+async def idempotent_lookup(path, params):
+    """IdempotencyCache.lookup без блокировки цикла событий на ожидании повтора."""
+    body, waiter = api_server.idempotency.claim(path, params)
+    if waiter is not None:
+        # Опрос вместо waiter.wait в пуле: ожидающий повтор не занимает поток
+        deadline = time.monotonic() + PENDING_TIMEOUT
+        while not waiter.is_set() and time.monotonic() < deadline:
+            await asyncio.sleep(PENDING_POLL_INTERVAL)
+        body, _ = api_server.idempotency.claim(path, params)
+    return body
+
+async def send_response(send, status, body, content_type):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", content_type),
+            (b"content-length", str(len(body)).encode("ascii"))
+        ]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await callback_writer.start()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await callback_writer.stop()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    path = scope["path"]
+    params = query_params(scope)
+    log_token = gateway_logging.bind_request(params.get("trx_id"), params.get("o.order_id"))
+    started = time.perf_counter()
+    try:
+        if path == "/operation/check":
+            # Повтор с тем же trx_id получает запомненный ответ и не ставится в очередь
+            body = await idempotent_lookup(path, params)
+            if body is None:
+                try:
+                    token = params.get("trx_id")
+                    if token:
+                        await callback_writer.submit(token, api_server.callback_record("CPAReq", token, params))
+                    body = api_server.check_response(params)
+                    api_server.idempotency.store(path, params, body)
+                finally:
+                    api_server.idempotency.release(path, params)
+            await send_response(send, 200, body, b"text/xml; charset=utf-8")
+        elif path == "/operation/callback":
+            body = await idempotent_lookup(path, params)
+            if body is None:
+                try:
+                    trx_id = params.get("trx_id")
+                    if trx_id:
+                        await callback_writer.submit(trx_id, api_server.callback_record("RPReq", trx_id, params))
+                    body = api_server.register_response(params)
+                    api_server.idempotency.store(path, params, body)
+                finally:
+                    api_server.idempotency.release(path, params)
+            await send_response(send, 200, body, b"text/xml; charset=utf-8")
+        elif path == "/metrics":
+            await send_response(send, 200, metrics.render().encode("utf-8"), b"text/plain; version=0.0.4")
+        elif path == "/ping":
+            body = json.dumps({"status": "ok", "time": datetime.now().isoformat()}).encode("utf-8")
+            await send_response(send, 200, body, b"application/json")
+        else:
+            path = "unmatched"
+            await send_response(send, 404, b"Not Found", b"text/plain; charset=utf-8")
+        metrics.observe("gateway_request_seconds", time.perf_counter() - started, route=path)
+    finally:
+        gateway_logging.reset_request(log_token)
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=7443)
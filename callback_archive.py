@@ -0,0 +1,216 @@
+"""
+Архив коллбэков, вытесненных из журнала callbacks.jsonl.
+
+При компакции журнала выпавшие из окна записи не теряются, а уходят
+сюда пачкой. Архив разбит по дням (каталог YYYY-MM-DD), каждая пачка -
+отдельный неизменяемый сегмент, хранящий записи по столбцам:
+
+    CBSEG1\\n | длина заголовка (4 байта) | заголовок JSON | столбцы
+
+Ключи raw_params заносятся в словарь сегмента, и каждому ключу
+соответствует свой столбец p<номер>. Столбец - список значений
+(null там, где у записи нет такого ключа), сжатый zlib; если различных
+значений мало, вместо них хранятся номера в списке уникальных значений.
+Заголовок хранит смещения столбцов, поэтому scan() по одному полю
+распаковывает только этот столбец и не собирает записи целиком.
+
+    python callback_archive.py scan result_code --from 2026-01-01
+    python callback_archive.py dump 2026-01-15
+"""
+import argparse
+import array
+import json
+import os
+import struct
+import sys
+import threading
+import zlib
+from collections import Counter
+
+try:
+    from .storage import atomic_write
+except ImportError:
+    from storage import atomic_write
+
+MAGIC = b"CBSEG1\n"
+SEGMENT_SUFFIX = ".cbseg"
+
+# Столбцы самой записи; остальные - ключи raw_params
+RECORD_COLUMNS = ("token", "timestamp", "seq", "type", "data_timestamp")
+
+def _encode_column(values):
+    distinct = list(dict.fromkeys(json.dumps(value, ensure_ascii=False) for value in values))
+    if len(distinct) <= 65535 and len(distinct) * 4 <= len(values):
+        # Словарное кодирование: уникальные значения и по номеру на запись
+        index = {value: i for i, value in enumerate(distinct)}
+        codes = array.array("H", (index[json.dumps(value, ensure_ascii=False)] for value in values))
+        payload = ("[" + ",".join(distinct) + "]").encode("utf-8")
+        blob = struct.pack(">I", len(payload)) + payload + codes.tobytes()
+        return "dict", zlib.compress(blob)
+    return "plain", zlib.compress(json.dumps(values, ensure_ascii=False).encode("utf-8"))
+
+def _decode_column(encoding, blob):
+    data = zlib.decompress(blob)
+    if encoding == "plain":
+        return json.loads(data)
+    size = struct.unpack(">I", data[:4])[0]
+    distinct = json.loads(data[4:4 + size])
+    codes = array.array("H")
+    codes.frombytes(data[4 + size:])
+    return [distinct[code] for code in codes]
+
+def _record_value(record, column):
+    data = record.get("data", {})
+    if column == "type":
+        return data.get("type")
+    if column == "data_timestamp":
+        return data.get("timestamp")
+    return record.get(column)
+
+class CallbackArchive:
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._counter = 0
+
+    def append(self, records):
+        """Раскладывает записи журнала по дневным сегментам."""
+        by_day = {}
+        for record in records:
+            by_day.setdefault(str(record.get("timestamp", ""))[:10] or "unknown", []).append(record)
+        for day, day_records in by_day.items():
+            self._write_segment(day, day_records)
+
+    def _write_segment(self, day, records):
+        keys = list(dict.fromkeys(key for record in records
+                                  for key in record.get("data", {}).get("raw_params", {})))
+        columns = {column: [_record_value(record, column) for record in records] for column in RECORD_COLUMNS}
+        for i, key in enumerate(keys):
+            columns[f"p{i}"] = [record.get("data", {}).get("raw_params", {}).get(key) for record in records]
+
+        header = {"count": len(records), "keys": keys, "columns": {}}
+        blobs = []
+        offset = 0
+        for name, values in columns.items():
+            encoding, blob = _encode_column(values)
+            header["columns"][name] = [offset, len(blob), encoding]
+            blobs.append(blob)
+            offset += len(blob)
+        header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+
+        day_dir = os.path.join(self.directory, day)
+        os.makedirs(day_dir, exist_ok=True)
+        with self._lock:
+            self._counter += 1
+            name = f"{records[0].get('seq', 0):012d}-{os.getpid()}-{self._counter}{SEGMENT_SUFFIX}"
+        atomic_write(os.path.join(day_dir, name),
+                     MAGIC + struct.pack(">I", len(header_bytes)) + header_bytes + b"".join(blobs),
+                     durable=True)
+
+    def days(self):
+        try:
+            return sorted(name for name in os.listdir(self.directory)
+                          if os.path.isdir(os.path.join(self.directory, name)))
+        except FileNotFoundError:
+            return []
+
+    def segments(self, day_from=None, day_to=None):
+        """Пути сегментов за дни из [day_from, day_to] по порядку."""
+        for day in self.days():
+            if (day_from and day < day_from) or (day_to and day > day_to):
+                continue
+            day_dir = os.path.join(self.directory, day)
+            for name in sorted(os.listdir(day_dir)):
+                if name.endswith(SEGMENT_SUFFIX):
+                    yield os.path.join(day_dir, name)
+
+    def _read_header(self, f):
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{f.name} is not a callback archive segment")
+        size = struct.unpack(">I", f.read(4))[0]
+        return json.loads(f.read(size)), len(MAGIC) + 4 + size
+
+    def _read_column(self, f, header, base, name):
+        column = header["columns"].get(name)
+        if column is None:
+            return [None] * header["count"]
+        offset, length, encoding = column
+        f.seek(base + offset)
+        return _decode_column(encoding, f.read(length))
+
+    def _column_name(self, header, field):
+        if field in RECORD_COLUMNS:
+            return field
+        try:
+            return f"p{header['keys'].index(field)}"
+        except ValueError:
+            return None
+
+    def scan(self, field, day_from=None, day_to=None):
+        """
+        Значения одного поля по всем записям: столбец записи (token,
+        timestamp, seq, type, data_timestamp) или ключ raw_params.
+        Читается только этот столбец.
+        """
+        for path in self.segments(day_from, day_to):
+            with open(path, "rb") as f:
+                header, base = self._read_header(f)
+                name = self._column_name(header, field)
+                if name is None:
+                    yield from [None] * header["count"]
+                    continue
+                yield from self._read_column(f, header, base, name)
+
+    def records(self, day_from=None, day_to=None):
+        """Восстанавливает записи целиком (в том виде, как они были в журнале)."""
+        for path in self.segments(day_from, day_to):
+            with open(path, "rb") as f:
+                header, base = self._read_header(f)
+                columns = {name: self._read_column(f, header, base, name) for name in header["columns"]}
+            for i in range(header["count"]):
+                raw_params = {}
+                for k, key in enumerate(header["keys"]):
+                    value = columns[f"p{k}"][i]
+                    if value is not None:
+                        raw_params[key] = value
+                yield {
+                    "token": columns["token"][i],
+                    "timestamp": columns["timestamp"][i],
+                    "data": {
+                        "type": columns["type"][i],
+                        "timestamp": columns["data_timestamp"][i],
+                        "token": columns["token"][i],
+                        "raw_params": raw_params
+                    },
+                    "seq": columns["seq"][i]
+                }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Просмотр архива коллбэков")
+    parser.add_argument("--dir", help="каталог архива; по умолчанию из tester_config")
+    commands = parser.add_subparsers(dest="command", required=True)
+    scan = commands.add_parser("scan", help="распределение значений одного поля")
+    scan.add_argument("field")
+    scan.add_argument("--from", dest="day_from")
+    scan.add_argument("--to", dest="day_to")
+    dump = commands.add_parser("dump", help="записи за день в JSONL")
+    dump.add_argument("day")
+    args = parser.parse_args(argv)
+
+    directory = args.dir
+    if directory is None:
+        from tester_config import CALLBACKS_ARCHIVE
+        directory = CALLBACKS_ARCHIVE
+    archive = CallbackArchive(directory)
+
+    if args.command == "scan":
+        counts = Counter(archive.scan(args.field, args.day_from, args.day_to))
+        for value, count in counts.most_common():
+            print(f"{count:>10}  {value}")
+    else:
+        for record in archive.records(args.day, args.day):
+            print(json.dumps(record, ensure_ascii=False))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
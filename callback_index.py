@@ -0,0 +1,215 @@
+"""
+Поисковый индекс коллбэков в SQLite.
+
+Журнал callbacks.jsonl держит только окно последних коллбэков, а индекс
+хранит всю историю: каждая запись кладется сюда целиком, а поля для
+поиска (тип, o.order_id, result_code, card.id, p.paymentSystem, время)
+вынесены в отдельные столбцы с индексами. Запрос по любому из них идет
+по индексу и читает только одну страницу результатов.
+
+Страницы отдаются от новых к старым, курсор - id последней записи
+страницы (keyset-пагинация), так что глубина листания не влияет на
+стоимость запроса. Там же таблица orders - созданные в тестере заказы:
+по ней и по коллбэкам LifecycleTracker считает воронку в любом процессе
+и после перезапуска. База в режиме WAL: api_server и tester пишут в нее
+из разных процессов, а чтение не ждет записи.
+"""
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Параметр запроса -> столбец таблицы
+SEARCH_FIELDS = {
+    "token": "token",
+    "type": "type",
+    "order_id": "order_id",
+    "result_code": "result_code",
+    "card_id": "card_id",
+    "payment_system": "payment_system"
+}
+
+# Запись однозначно определяется номером seq из журнала. Токен входит в
+# ключ на случай, если журнал удалили и seq начался заново. Время для
+# этого не годится: у коллбэков одной пачки оно может совпадать
+CALLBACKS_TABLE = """
+CREATE TABLE IF NOT EXISTS {table} (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    seq INTEGER,
+    token TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    type TEXT,
+    order_id TEXT,
+    result_code TEXT,
+    card_id TEXT,
+    payment_system TEXT,
+    record TEXT NOT NULL,
+    UNIQUE (seq, token)
+);
+"""
+
+SCHEMA = CALLBACKS_TABLE.format(table="callbacks") + """
+CREATE INDEX IF NOT EXISTS callbacks_token ON callbacks (token, id);
+CREATE INDEX IF NOT EXISTS callbacks_type ON callbacks (type, id);
+CREATE INDEX IF NOT EXISTS callbacks_order_id ON callbacks (order_id, id);
+CREATE INDEX IF NOT EXISTS callbacks_result_code ON callbacks (result_code, id);
+CREATE INDEX IF NOT EXISTS callbacks_card_id ON callbacks (card_id, id);
+CREATE INDEX IF NOT EXISTS callbacks_payment_system ON callbacks (payment_system, id);
+CREATE INDEX IF NOT EXISTS callbacks_timestamp ON callbacks (timestamp);
+CREATE TABLE IF NOT EXISTS orders (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    order_id TEXT NOT NULL UNIQUE,
+    created_at TEXT NOT NULL
+);
+"""
+
+def _row(record):
+    data = record.get("data", {})
+    params = data.get("raw_params", {})
+    return (
+        record.get("seq"),
+        record["token"],
+        record["timestamp"],
+        data.get("type"),
+        params.get("o.order_id"),
+        params.get("result_code"),
+        params.get("card.id") or params.get("src.cardId"),
+        params.get("p.paymentSystem"),
+        json.dumps(record, ensure_ascii=False)
+    )
+
+class CallbackIndex:
+    def __init__(self, path, backfill=None):
+        self.path = path
+        # Источник уже сохраненных коллбэков для первичного наполнения
+        self.backfill = backfill
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        # После fork соединение родителя использовать нельзя
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.path, timeout=5)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with self._init_lock:
+            exists = conn.execute(
+                "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'callbacks'"
+            ).fetchone()
+            if exists and "UNIQUE (token, timestamp)" in exists[0]:
+                self._migrate_unique_key(conn)
+            # Схема создается с IF NOT EXISTS, так что в старую базу
+            # просто добавятся недостающие таблицы
+            conn.executescript(SCHEMA)
+            if not exists and self.backfill is not None:
+                self._insert(conn, self.backfill())
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _migrate_unique_key(self, conn):
+        """
+        Переносит базу со старым ключом UNIQUE (token, timestamp) в таблицу
+        с ключом по seq. SQLite не умеет менять ограничения, поэтому
+        таблица пересоздается; индексы потом создаст SCHEMA.
+        """
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Пока ждали блокировку, базу мог перенести другой процесс
+            sql = conn.execute(
+                "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'callbacks'"
+            ).fetchone()[0]
+            if "UNIQUE (token, timestamp)" in sql:
+                conn.execute(CALLBACKS_TABLE.format(table="callbacks_migrated"))
+                conn.execute("INSERT OR IGNORE INTO callbacks_migrated SELECT * FROM callbacks ORDER BY id")
+                conn.execute("DROP TABLE callbacks")
+                conn.execute("ALTER TABLE callbacks_migrated RENAME TO callbacks")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    def _insert(self, conn, records):
+        with conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO callbacks (seq, token, timestamp, type, order_id, result_code,"
+                " card_id, payment_system, record) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [_row(record) for record in records]
+            )
+
+    def add(self, record):
+        """Индексирует запись журнала (с token, timestamp, seq и data)."""
+        self._insert(self._connect(), [record])
+
+    def add_many(self, records):
+        """Индексирует пачку записей одной транзакцией."""
+        self._insert(self._connect(), records)
+
+    def add_orders(self, order_ids):
+        """Отмечает заказы созданными; повторно тот же номер не добавляется."""
+        now = datetime.now().isoformat()
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO orders (order_id, created_at) VALUES (?, ?)",
+                [(str(order_id), now) for order_id in order_ids]
+            )
+
+    def orders_after(self, cursor, limit=MAX_PAGE_SIZE):
+        """Заказы с id больше cursor в порядке создания: [(id, номер заказа)]."""
+        return self._connect().execute(
+            "SELECT id, order_id FROM orders WHERE id > ? ORDER BY id LIMIT ?", (cursor, limit)
+        ).fetchall()
+
+    def get(self, token):
+        """Последняя запись с этим токеном или None."""
+        row = self._connect().execute(
+            "SELECT record FROM callbacks WHERE token = ? ORDER BY id DESC LIMIT 1", (token,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def after(self, cursor, limit=MAX_PAGE_SIZE):
+        """Записи с id больше cursor в порядке поступления: [(id, запись)]."""
+        rows = self._connect().execute(
+            "SELECT id, record FROM callbacks WHERE id > ? ORDER BY id LIMIT ?", (cursor, limit)
+        ).fetchall()
+        return [(row_id, json.loads(record)) for row_id, record in rows]
+
+    def search(self, filters=None, since=None, until=None, cursor=None, limit=DEFAULT_PAGE_SIZE):
+        """
+        Возвращает (записи, следующий курсор) от новых к старым. filters -
+        словарь из SEARCH_FIELDS, since/until - границы времени в ISO-формате
+        (until не включается). Следующий курсор None, если страница последняя.
+        """
+        limit = max(1, min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+        conditions = []
+        args = []
+        for name, value in (filters or {}).items():
+            conditions.append(f"{SEARCH_FIELDS[name]} = ?")
+            args.append(value)
+        if since:
+            conditions.append("timestamp >= ?")
+            args.append(since)
+        if until:
+            conditions.append("timestamp < ?")
+            args.append(until)
+        if cursor:
+            conditions.append("id < ?")
+            args.append(cursor)
+
+        query = "SELECT id, record FROM callbacks"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        # Одна лишняя строка показывает, есть ли следующая страница
+        query += " ORDER BY id DESC LIMIT ?"
+        args.append(limit + 1)
+
+        rows = self._connect().execute(query, args).fetchall()
+        next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+        return [json.loads(record) for _, record in rows[:limit]], next_cursor
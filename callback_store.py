@@ -0,0 +1,343 @@
+"""
+Хранилище коллбэков в виде append-only журнала (JSONL).
+
+Каждая запись - одна строка JSON в конце файла. В памяти держится
+индекс token -> смещение строки в журнале, поэтому поиск по токену
+стоит одного seek+readline, а запись нового коллбэка - одной дозаписи.
+Устаревшие строки (вытесненные окном хранения или перезаписанные тем же
+токеном) убираются периодической компакцией, а не переписыванием файла
+на каждый коллбэк.
+
+Вытесненные при компакции записи передаются в on_evict (архив), а не
+просто отбрасываются. Если архив недоступен, компакция пропускается и
+повторяется не раньше чем через COMPACT_RETRY_DELAY: журнал временно
+растет, но записи не теряются, а уже выполненная дозапись не падает.
+
+Журнал могут дописывать несколько процессов (api_server и tester):
+запись идет под flock, а индекс догоняет хвост файла перед чтением.
+Под тем же flock каждой записи присваивается сквозной номер seq - он
+служит курсором для выборки только новых коллбэков.
+
+Запись групповая: пока один поток пишет в журнал, коллбэки остальных
+потоков копятся в следующую пачку, и она уходит одним write под одним
+flock. С commit_delay лидер пачки еще и ждет столько секунд попутчиков.
+"""
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+try:
+    from .storage import temp_path
+except ImportError:
+    from storage import temp_path
+
+log = logging.getLogger(__name__)
+
+# Компакция запускается, когда мертвых строк в журнале больше, чем
+# окно хранения плюс COMPACT_SLACK: так ее стоимость размазывается
+# по дозаписям и остается O(1) на коллбэк при любом окне
+COMPACT_SLACK = 1000
+
+# Через сколько секунд повторять компакцию после ошибки архива
+COMPACT_RETRY_DELAY = 60
+
+# Как часто ожидающие новых записей проверяют журнал, который могли
+# дописать другие процессы
+POLL_INTERVAL = 0.25
+
+# Пачка коллбэков для групповой записи
+class _Batch:
+    def __init__(self):
+        self.records = []
+        self.done = threading.Event()
+        self.error = None
+
+class CallbackStore:
+    def __init__(self, path, retention=50, legacy_path=None, on_evict=None, commit_delay=0):
+        self.path = path
+        self.retention = retention
+        self.legacy_path = legacy_path
+        self.on_evict = on_evict
+        self.commit_delay = commit_delay
+        self._batch = None
+        self._batch_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._index = OrderedDict()
+        self._lines = 0
+        self._pos = 0
+        self._ino = None
+        self._last_seq = 0
+        self._compact_not_before = 0
+        self._lock = threading.RLock()
+        self._changed = threading.Condition(self._lock)
+
+    def _open_locked(self):
+        """
+        Открывает журнал на дозапись под эксклюзивным flock. Если за время
+        ожидания блокировки файл подменили компакцией - открывает заново.
+        """
+        while True:
+            f = open(self.path, "ab")
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                if os.fstat(f.fileno()).st_ino == os.stat(self.path).st_ino:
+                    return f
+            except FileNotFoundError:
+                pass
+            f.close()
+
+    def _migrate_legacy(self):
+        # Одноразовый перенос старого callbacks.json в журнал
+        if os.path.exists(self.path) or not self.legacy_path or not os.path.exists(self.legacy_path):
+            return
+        try:
+            with open(self.legacy_path, "r", encoding="utf-8") as f:
+                records = json.load(f)
+        except Exception:
+            return
+        with self._open_locked() as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                records = records[-self.retention:]
+                for seq, record in enumerate(records, 1):
+                    record["seq"] = seq
+                f.write(b"".join(self._encode(record) for record in records))
+
+    def _encode(self, record):
+        return (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+
+    def _catch_up(self):
+        """Дочитывает в индекс строки, появившиеся в журнале с прошлого раза."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            self._migrate_legacy()
+            if not os.path.exists(self.path):
+                return
+            st = None
+
+        # Быстрый путь: журнал не менялся
+        if st is not None and st.st_ino == self._ino and st.st_size == self._pos:
+            return
+
+        with open(self.path, "rb") as f:
+            st = os.fstat(f.fileno())
+            if st.st_ino != self._ino or st.st_size < self._pos:
+                # Журнал был компактирован (возможно, другим процессом)
+                self._index = OrderedDict()
+                self._lines = 0
+                self._pos = 0
+                self._last_seq = 0
+                self._ino = st.st_ino
+            f.seek(self._pos)
+            chunk = f.read(st.st_size - self._pos)
+
+        offset = self._pos
+        # Незаконченную последнюю строку (запись в процессе) оставляем на потом
+        end = chunk.rfind(b"\n") + 1
+        for line in chunk[:end].splitlines(keepends=True):
+            try:
+                record = json.loads(line)
+                token = record["token"]
+                seq = record.get("seq", 0)
+            except Exception:
+                token = None
+            if token is not None:
+                self._index.pop(token, None)
+                self._index[token] = (offset, seq)
+                self._last_seq = max(self._last_seq, seq)
+                if len(self._index) > self.retention:
+                    self._index.popitem(last=False)
+            self._lines += 1
+            offset += len(line)
+        self._pos = offset
+
+    def _open_reader(self):
+        """
+        Открывает журнал на чтение, убедившись, что индекс построен
+        именно по этому файлу (а не по версии до чужой компакции).
+        """
+        while True:
+            self._catch_up()
+            if not self._index:
+                return None
+            f = open(self.path, "rb")
+            if os.fstat(f.fileno()).st_ino == self._ino:
+                return f
+            f.close()
+
+    def _read_at(self, f, offset):
+        f.seek(offset)
+        return json.loads(f.readline())
+
+    def append(self, token, data):
+        return self.append_many([(token, data)])[0]
+
+    def append_many(self, items):
+        """Дописывает коллбэки [(token, data)] и возвращает их записи с seq."""
+        # Время у каждой записи свое: CPAReq и RPReq одной пачки не должны
+        # выглядеть одновременными
+        records = [{"token": token, "timestamp": datetime.now().isoformat(), "data": data} for token, data in items]
+
+        with self._batch_lock:
+            batch = self._batch
+            leader = batch is None
+            if leader:
+                batch = self._batch = _Batch()
+            batch.records.extend(records)
+
+        if leader:
+            # Пока ждем предыдущую запись (и commit_delay), пачка открыта
+            # для коллбэков других потоков
+            with self._write_lock:
+                if self.commit_delay:
+                    time.sleep(self.commit_delay)
+                with self._batch_lock:
+                    self._batch = None
+                try:
+                    self._write(batch.records)
+                except Exception as e:
+                    batch.error = e
+                finally:
+                    batch.done.set()
+        else:
+            batch.done.wait()
+
+        if batch.error is not None:
+            raise batch.error
+        return records
+
+    def _write(self, records):
+        with self._lock:
+            self._migrate_legacy()
+            with self._open_locked() as f:
+                # Под блокировкой журнал не растет, поэтому последний seq точный
+                self._catch_up()
+                for seq, record in enumerate(records, self._last_seq + 1):
+                    record["seq"] = seq
+                f.write(b"".join(self._encode(record) for record in records))
+            self._catch_up()
+            if (self._lines - len(self._index) > self.retention + COMPACT_SLACK
+                    and time.monotonic() >= self._compact_not_before):
+                try:
+                    self.compact()
+                except Exception:
+                    # Коллбэки уже в журнале - дозапись успешна при любой ошибке компакции
+                    log.exception("Callback log compaction failed")
+                    self._compact_not_before = time.monotonic() + COMPACT_RETRY_DELAY
+            self._changed.notify_all()
+
+    def get(self, token):
+        """Возвращает запись по токену или None."""
+        with self._lock:
+            f = self._open_reader()
+            if f is None:
+                return None
+            with f:
+                entry = self._index.get(token)
+                if entry is None:
+                    return None
+                return self._read_at(f, entry[0])
+
+    def all(self):
+        """Возвращает живые записи в порядке поступления."""
+        with self._lock:
+            f = self._open_reader()
+            if f is None:
+                return []
+            with f:
+                return [self._read_at(f, offset) for offset, seq in self._index.values()]
+
+    def last_seq(self):
+        """Курсор, соответствующий последней записи в журнале."""
+        with self._lock:
+            self._catch_up()
+            return self._last_seq
+
+    def version(self):
+        """(inode журнала, последний seq) - меняется с каждой записью и компакцией."""
+        with self._lock:
+            self._catch_up()
+            return (self._ino, self._last_seq)
+
+    def since(self, cursor):
+        """Возвращает живые записи с seq больше cursor в порядке поступления."""
+        with self._lock:
+            f = self._open_reader()
+            if f is None:
+                return []
+            with f:
+                # Порядок индекса совпадает с порядком seq, так что идем с конца
+                # и останавливаемся на первой уже известной клиенту записи
+                offsets = []
+                for token in reversed(self._index):
+                    offset, seq = self._index[token]
+                    if seq <= cursor:
+                        break
+                    offsets.append(offset)
+                return [self._read_at(f, offset) for offset in reversed(offsets)]
+
+    def wait(self, cursor, timeout):
+        """
+        Ждет появления записей новее cursor не дольше timeout секунд.
+        Записи из своего процесса будят сразу, чужие - в пределах POLL_INTERVAL.
+        """
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while True:
+                self._catch_up()
+                if self._last_seq > cursor:
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._changed.wait(min(remaining, POLL_INTERVAL))
+
+    def compact(self):
+        """
+        Переписывает журнал, оставляя только записи из окна хранения.
+        Возвращает False, если компакция пропущена из-за ошибки архива.
+        """
+        with self._lock:
+            with self._open_locked() as f:
+                self._catch_up()
+                tmp_path = temp_path(self.path)
+                try:
+                    live = {offset for offset, seq in self._index.values()}
+                    evicted = []
+                    with open(self.path, "rb") as src, open(tmp_path, "wb") as dst:
+                        offset = 0
+                        for line in src:
+                            if offset in live:
+                                dst.write(line)
+                            elif self.on_evict is not None and line.endswith(b"\n"):
+                                try:
+                                    evicted.append(json.loads(line))
+                                except ValueError:
+                                    pass
+                            offset += len(line)
+                    # Архив пишется до подмены журнала: при падении между ними
+                    # записи окажутся в архиве дважды, но не пропадут
+                    if evicted:
+                        try:
+                            self.on_evict(evicted)
+                        except Exception:
+                            # Без архива вытесненные записи пропали бы - журнал
+                            # остается как есть до следующей попытки
+                            log.exception("Failed to archive %d evicted callbacks, compaction skipped", len(evicted))
+                            self._compact_not_before = time.monotonic() + COMPACT_RETRY_DELAY
+                            return False
+                    os.replace(tmp_path, self.path)
+                finally:
+                    try:
+                        os.unlink(tmp_path)
+                    except FileNotFoundError:
+                        pass
+            # Индекс перестроится из нового файла при следующем чтении
+            self._ino = None
+            self._catch_up()
+            return True
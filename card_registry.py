@@ -0,0 +1,166 @@
+"""
+Реестр сохраненных тестовых карт.
+
+Карты лежат в памяти в OrderedDict по card_id: повторная регистрация
+переносит карту в конец, а при превышении capacity вытесняется самая
+давняя. Для выбора карты в интерфейсе рекуррентных платежей держатся
+индексы по платежной системе и по masked_pan (отсортированный список,
+поиск по префиксу через bisect), так что ни один запрос не перебирает
+все карты.
+
+Запись в cards.json отложенная: изменения копятся flush_delay секунд и
+уходят на диск одним атомарным переписыванием из фонового таймера.
+Если файл за это время изменил другой процесс, его содержимое сначала
+подчитывается, и поверх него применяются свои новые карты.
+"""
+import atexit
+import bisect
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+try:
+    from .storage import atomic_write_json, file_lock, file_stamp
+except ImportError:
+    from storage import atomic_write_json, file_lock, file_stamp
+
+class CardRegistry:
+    def __init__(self, path, capacity=50, flush_delay=1.0):
+        self.path = path
+        self.capacity = capacity
+        self.flush_delay = flush_delay
+        self._cards = OrderedDict()
+        self._by_system = {}
+        self._pans = []
+        self._pending = OrderedDict()
+        self._stamp = None
+        self._loaded = False
+        # Растет при каждом изменении набора карт в памяти
+        self._generation = 0
+        self._timer = None
+        self._lock = threading.RLock()
+        atexit.register(self.flush)
+
+    def _read_file(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                cards = json.load(f)
+            return cards if isinstance(cards, list) else []
+        except (OSError, ValueError):
+            return []
+
+    def _index(self, card):
+        system = card.get("payment_system", "")
+        self._by_system.setdefault(system, OrderedDict())[card["card_id"]] = None
+        bisect.insort(self._pans, (card.get("masked_pan", ""), card["card_id"]))
+
+    def _unindex(self, card):
+        system = card.get("payment_system", "")
+        ids = self._by_system.get(system)
+        if ids is not None:
+            ids.pop(card["card_id"], None)
+            if not ids:
+                del self._by_system[system]
+        key = (card.get("masked_pan", ""), card["card_id"])
+        i = bisect.bisect_left(self._pans, key)
+        if i < len(self._pans) and self._pans[i] == key:
+            del self._pans[i]
+
+    def _put(self, card):
+        self._generation += 1
+        old = self._cards.pop(card["card_id"], None)
+        if old is not None:
+            self._unindex(old)
+        self._cards[card["card_id"]] = card
+        self._index(card)
+        while len(self._cards) > self.capacity:
+            _, evicted = self._cards.popitem(last=False)
+            self._unindex(evicted)
+
+    def _load(self, cards):
+        self._generation += 1
+        self._cards = OrderedDict()
+        self._by_system = {}
+        self._pans = []
+        for card in cards:
+            if isinstance(card, dict) and card.get("card_id"):
+                self._put(card)
+        # Свои еще не записанные карты остаются поверх прочитанного
+        for card in self._pending.values():
+            self._put(card)
+
+    def _refresh(self):
+        stamp = file_stamp(self.path)
+        if self._loaded and stamp == self._stamp:
+            return
+        self._load(self._read_file())
+        self._stamp = stamp
+        self._loaded = True
+
+    def add(self, card_data):
+        card = {
+            "card_id": card_data.get("card_id"),
+            "masked_pan": card_data.get("masked_pan", ""),
+            "expiry": card_data.get("expiry", ""),
+            "payment_system": card_data.get("payment_system", ""),
+            "timestamp": datetime.now().isoformat(),
+            "registered": card_data.get("registered", "N")
+        }
+        with self._lock:
+            self._refresh()
+            self._put(card)
+            self._pending.pop(card["card_id"], None)
+            self._pending[card["card_id"]] = card
+            if self._timer is None:
+                self._timer = threading.Timer(self.flush_delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        return card
+
+    def flush(self):
+        """Записывает накопленные изменения в cards.json."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._pending:
+                return
+            with file_lock(self.path):
+                # Подхватываем то, что успели записать другие процессы
+                self._refresh()
+                atomic_write_json(self.path, list(self._cards.values()), indent=2)
+                self._stamp = file_stamp(self.path)
+            self._pending = OrderedDict()
+
+    def version(self):
+        """Номер версии набора карт; меняется, только если карты изменились."""
+        with self._lock:
+            self._refresh()
+            return self._generation
+
+    def all(self):
+        """Карты от самой давней к самой свежей."""
+        with self._lock:
+            self._refresh()
+            return list(self._cards.values())
+
+    def get(self, card_id):
+        with self._lock:
+            self._refresh()
+            return self._cards.get(card_id)
+
+    def by_payment_system(self, payment_system):
+        with self._lock:
+            self._refresh()
+            return [self._cards[card_id] for card_id in self._by_system.get(payment_system, ())]
+
+    def by_pan_prefix(self, prefix):
+        with self._lock:
+            self._refresh()
+            cards = []
+            i = bisect.bisect_left(self._pans, (prefix,))
+            while i < len(self._pans) and self._pans[i][0].startswith(prefix):
+                cards.append(self._cards[self._pans[i][1]])
+                i += 1
+            return cards
@@ -0,0 +1,223 @@
+"""
+Сборка ответа payment-avail-response для CPAReq.
+
+Почти весь ответ зависит только от настроек, поэтому для каждой версии
+настроек он один раз компилируется в байтовый шаблон, а на каждый
+запрос подставляется только order_id.
+"""
+import logging
+import threading
+
+try:
+    from .aft_destinations import NON_DIGITS_PATTERN, normalize_value_for_type
+    from .profiles import DEFAULT_PROFILE
+    from .xml_writer import XmlWriter, escape_text
+except ImportError:
+    from aft_destinations import NON_DIGITS_PATTERN, normalize_value_for_type
+    from profiles import DEFAULT_PROFILE
+    from xml_writer import XmlWriter, escape_text
+
+log = logging.getLogger(__name__)
+
+RESPONSE_HEAD = """<?xml version='1.0' standalone='yes'?>
+<payment-avail-response>
+  <result>
+    <code>1</code>
+    <desc>Payment is available</desc>
+  </result>
+  <merchant-trx>"""
+
+SUBMERCHANT_FIELDS = ["city", "country", "id", "name", "terminal-id", "mcc", "inn"]
+TRANSACTION_TYPES = ['CardRegister', 'Payment', 'AFT', 'OCT', 'P2P']
+
+def build_cpa_extensions_xml(extensions, aft_enabled=False,
+                            aft_mir_extension_type=None,
+                            aft_mir_extension_value=None,
+                            aft_mir_extension_country=None,
+                            aft_mir_extension_phone=None,
+                            writer=None, depth=0):
+    """
+    Собирает XML для расширений CPA согласно документации v.1.1
+    Для AFT операций добавляет <mir-extension> с корректными тегами.
+    Если передан writer, элементы дописываются в него на глубине depth,
+    иначе возвращается отдельная строка.
+    """
+    standalone = writer is None
+    if standalone:
+        writer = XmlWriter()
+
+    # Добавляем стандартные расширения CPA
+    if 'submerchant-data' in extensions:
+        submerchant = extensions['submerchant-data']
+        writer.open("submerchant-data", depth, inline=True)
+        for field in SUBMERCHANT_FIELDS:
+            if field in submerchant:
+                writer.element(field, submerchant[field])
+        writer.close()
+
+    if 'order-params' in extensions and isinstance(extensions['order-params'], list):
+        writer.open("order-params", depth, inline=True)
+        for param in extensions['order-params']:
+            if isinstance(param, dict) and 'name' in param and 'value' in param:
+                writer.open("param")
+                writer.element("name", param['name'])
+                writer.element("value", param['value'])
+                writer.close()
+        writer.close()
+
+    # Добавляем AFT mir-extension если включен AFT
+    if aft_enabled and aft_mir_extension_type:
+        log.debug("Building mir-extension for AFT: type=%s value=%s country=%s phone=%s",
+                  aft_mir_extension_type, aft_mir_extension_value,
+                  aft_mir_extension_country, aft_mir_extension_phone)
+
+        # Нормализуем значение в зависимости от типа
+        normalized_value, extracted_phone = normalize_value_for_type(
+            aft_mir_extension_value,
+            aft_mir_extension_type,
+            aft_mir_extension_country
+        )
+
+        log.debug("Normalized value: %s, extracted phone: %s", normalized_value, extracted_phone)
+
+        # Определяем телефон для использования
+        # Приоритет: 1) настройка phone, 2) извлеченный телефон, 3) пустая строка
+        phone_to_use = aft_mir_extension_phone or extracted_phone
+
+        # Определяем страну для использования
+        country_to_use = aft_mir_extension_country
+        if not country_to_use:
+            # Если страна не указана, используем BLR по умолчанию для всех типов
+            country_to_use = "BLR"
+            log.debug("Using default country: %s", country_to_use)
+
+        # Формируем mir-extension согласно примерам из документации.
+        # Дочерние теги исторически идут с одним отступом при любой
+        # глубине самого mir-extension
+        writer.open("mir-extension", depth)
+        writer.element("type", aft_mir_extension_type, 1)
+
+        # Добавляем значение
+        if normalized_value:
+            writer.element("value", normalized_value, 1)
+        elif aft_mir_extension_value:
+            writer.element("value", aft_mir_extension_value, 1)
+
+        # ВСЕГДА добавляем country для всех трех типов
+        if country_to_use:
+            writer.element("country", country_to_use, 1)
+
+        # Добавляем телефон ТОЛЬКО для типа destAbroadSWIFT согласно документации
+        if aft_mir_extension_type == "3ds2.destAbroadSWIFT" and phone_to_use:
+            # Убедимся, что телефон в правильном формате (только цифры)
+            phone_digits = NON_DIGITS_PATTERN.sub('', phone_to_use)
+            if phone_digits:
+                writer.element("phone", phone_digits, 1)
+
+        writer.close()
+
+        # Для AFT операций всегда добавляем transaction-type AFT
+        writer.element("transaction-type", "AFT", depth)
+    else:
+        # Если не AFT, используем стандартный transaction-type из настроек
+        transaction_type = extensions.get('transaction-type', 'Payment')
+        if transaction_type in TRANSACTION_TYPES:
+            writer.element("transaction-type", transaction_type, depth)
+
+    if standalone:
+        return writer.getvalue()
+
+def render_response_tail(settings, use_aft):
+    """
+    Собирает часть ответа после order_id: от </merchant-trx>
+    до закрывающего </payment-avail-response>.
+    """
+    # Создаем копию extensions, чтобы не модифицировать оригинальные настройки
+    extensions = settings.get('cpaExtensions', {}).copy()
+
+    # Если используем AFT, удаляем transaction-type из extensions чтобы избежать дублирования
+    if use_aft and 'transaction-type' in extensions:
+        del extensions['transaction-type']
+
+    writer = XmlWriter()
+    writer.raw("</merchant-trx>")
+    writer.open("purchase", 1)
+    writer.element("shortDesc", settings.get('shortDesc', 'Короткое описание'), 2)
+    writer.element("longDesc", settings.get('longDesc', 'Описание по умолчанию'), 2)
+    writer.open("account-amount", 2)
+    writer.element("id", "MAIN", 3)
+    writer.element("amount", settings['amount'], 3)
+    writer.element("currency", "643", 3)
+    writer.element("exponent", "2", 3)
+    writer.close()
+    writer.close()
+
+    if settings.get('recurrentEnabled') and settings.get('selectedCardId'):
+        writer.open("card", 1)
+        writer.element("id", settings['selectedCardId'], 2)
+        writer.element("present", "N", 2)
+        writer.close()
+
+    # Расширения пишутся сразу в ответ, на первом уровне вложенности
+    build_cpa_extensions_xml(
+        extensions,
+        use_aft,
+        settings.get('aftMirExtensionType'),
+        settings.get('aftMirExtensionValue'),
+        settings.get('aftMirExtensionCountry'),
+        settings.get('aftMirExtensionPhone'),
+        writer=writer,
+        depth=1
+    )
+
+    # Добавляем transaction-type для регистрации карт (только если не AFT)
+    if settings.get('cardRegistrationEnabled') and not use_aft:
+        writer.element("transaction-type", "CardRegister", 1)
+
+    # Закрываем XML
+    writer.raw("\n</payment-avail-response>")
+    return writer.getvalue()
+
+def render_payment_avail_response(settings, order_id, use_aft):
+    """Собирает полный ответ без использования кэша шаблонов."""
+    return RESPONSE_HEAD + escape_text(order_id) + render_response_tail(settings, use_aft)
+
+class CompiledResponses:
+    """
+    Кэш скомпилированных ответов для текущей версии настроек.
+
+    Варианты с рекуррентом и регистрацией карты задаются самими
+    настройками профиля и входят в версию, поэтому в пределах версии
+    шаблон различается только профилем и признаком AFT.
+    """
+    def __init__(self, profile_router):
+        self.profile_router = profile_router
+        # (version, {(profile, use_aft): (head, tail)}) - публикуется одним кортежем
+        self._cache = (None, {})
+        self._lock = threading.Lock()
+
+    def template(self, request_aft, profile=DEFAULT_PROFILE):
+        settings, version = self.profile_router.snapshot(profile)
+        key = (profile, bool(request_aft or settings.get('aftEnabled', False)))
+
+        cached_version, templates = self._cache
+        if cached_version == version and key in templates:
+            return templates[key]
+
+        with self._lock:
+            cached_version, templates = self._cache
+            if cached_version != version:
+                templates = {}
+            if key not in templates:
+                tail = render_response_tail(settings, key[1])
+                log.debug("Compiled payment-avail-response (version %s, profile %s, aft %s):\n%s{order_id}%s",
+                          version, profile, key[1], RESPONSE_HEAD, tail)
+                templates = dict(templates)
+                templates[key] = (RESPONSE_HEAD.encode("utf-8"), tail.encode("utf-8"))
+                self._cache = (version, templates)
+            return templates[key]
+
+    def render(self, order_id, request_aft=False, profile=DEFAULT_PROFILE):
+        """Возвращает байты ответа профиля profile с подставленным order_id."""
+        head, tail = self.template(request_aft, profile)
+        return b"".join((head, escape_text(order_id).encode("utf-8"), tail))
@@ -0,0 +1,129 @@
+"""
+Логирование для api_server.
+
+Записи уходят через QueueHandler в фоновый поток (QueueListener),
+который пишет их в stderr строками JSON. Обработчик запроса только
+кладет запись в очередь и не ждет записи на диск.
+
+К каждой записи добавляются trx_id и order_id текущего запроса. Уровень
+задается переменной GATEWAY_LOG_LEVEL и меняется на лету через
+set_level() или сигналом SIGUSR1 (переключение INFO <-> DEBUG).
+На уровне DEBUG подробные записи пишутся только для доли транзакций
+(GATEWAY_LOG_SAMPLE, в процентах): решение принимается по trx_id, так
+что выбранный платеж виден целиком от CPAReq до RPReq.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import signal
+import sys
+import zlib
+from datetime import datetime
+
+LOG_LEVEL = os.environ.get("GATEWAY_LOG_LEVEL", "INFO")
+LOG_SAMPLE_PERCENT = int(os.environ.get("GATEWAY_LOG_SAMPLE", "100"))
+
+_context = contextvars.ContextVar("gateway_log_context", default=None)
+_listener = None
+_sample_percent = LOG_SAMPLE_PERCENT
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        for key in ("trx_id", "order_id"):
+            value = getattr(record, key, None)
+            if value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+class ContextFilter(logging.Filter):
+    """Добавляет trx_id/order_id запроса и отсеивает DEBUG невыбранных транзакций."""
+    def filter(self, record):
+        context = _context.get()
+        if context is None:
+            return True
+        trx_id, order_id, sampled = context
+        if getattr(record, "trx_id", None) is None:
+            record.trx_id = trx_id
+        if getattr(record, "order_id", None) is None:
+            record.order_id = order_id
+        return sampled or record.levelno > logging.DEBUG
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Стандартный QueueHandler форматирует сообщение еще в потоке
+        # запроса; здесь это делает фоновый писатель
+        return record
+
+def is_sampled(trx_id):
+    if not trx_id or _sample_percent >= 100:
+        return True
+    return zlib.crc32(trx_id.encode("utf-8")) % 100 < _sample_percent
+
+def bind_request(trx_id=None, order_id=None):
+    """Привязывает trx_id/order_id к записям текущего запроса."""
+    return _context.set((trx_id, order_id, is_sampled(trx_id)))
+
+def reset_request(token):
+    _context.reset(token)
+
+def debug_enabled(logger):
+    """
+    Нужно ли вообще строить DEBUG-сообщение. Для дорогих аргументов
+    (например, полного XML) проверка делается до их вычисления.
+    """
+    if not logger.isEnabledFor(logging.DEBUG):
+        return False
+    context = _context.get()
+    return context is None or context[2]
+
+def set_level(level):
+    logging.getLogger().setLevel(level)
+
+def set_sample_percent(percent):
+    global _sample_percent
+    _sample_percent = percent
+
+def _toggle_debug(signum, frame):
+    root = logging.getLogger()
+    set_level(logging.INFO if root.level == logging.DEBUG else logging.DEBUG)
+
+def setup_logging(level=LOG_LEVEL, stream=None):
+    """Направляет корневой логгер в фоновый JSON-писатель."""
+    global _listener
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter())
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    set_level(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, output)
+    _listener.start()
+    # Дописываем очередь при остановке процесса
+    atexit.register(_listener.stop)
+
+    if hasattr(signal, "SIGUSR1"):
+        try:
+            signal.signal(signal.SIGUSR1, _toggle_debug)
+        except ValueError:
+            # signal.signal работает только из главного потока
+            pass
@@ -0,0 +1,146 @@
+"""
+Кэш ответов шлюза на повторные запросы банка.
+
+Если наш ответ задерживается, банк повторяет /operation/check и
+/operation/callback с тем же trx_id. Повтор должен получить тот же
+ответ байт в байт, а коллбэк не должен сохраняться второй раз. Поэтому
+ответ запоминается по ключу (маршрут, trx_id) на ttl секунд вместе с
+отпечатком параметров: запрос с тем же trx_id, но другими параметрами
+(например, другой result_code) - уже не повтор, а новый запрос.
+
+Повтор может прийти, пока первый запрос еще обрабатывается. Поэтому
+первый промах сразу кладет в кэш запись "в работе": запрос, получивший
+ее, становится владельцем и обязан вызвать store() или release(), а
+повторы ждут его ответа (не дольше PENDING_TIMEOUT) вместо того, чтобы
+сохранить коллбэк второй раз.
+
+Записи лежат в OrderedDict в порядке добавления. При постоянном ttl
+это и порядок истечения, так что просроченные снимаются с начала, а при
+превышении capacity вытесняются самые давние. Попадания, промахи и
+ожидания чужого ответа считаются в gateway_idempotency_total{route, result}.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    from . import metrics
+except ImportError:
+    import metrics
+
+# Сколько секунд повтор ждет ответа запроса, который еще в работе
+PENDING_TIMEOUT = 5.0
+
+metrics.registry.describe("gateway_idempotency_total", "Gateway requests answered from the retry cache (hit), built anew (miss) or held for an in-flight duplicate (wait)")
+
+class IdempotencyCache:
+    def __init__(self, ttl=60.0, capacity=10000):
+        self.ttl = ttl
+        self.capacity = capacity
+        # (route, trx_id) -> (время истечения, отпечаток параметров, ответ,
+        # событие готовности ответа). У записи "в работе" ответ None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.capacity > 0
+
+    def _fingerprint(self, params):
+        # Не hash(): он зависит от порядка параметров и от PYTHONHASHSEED
+        items = sorted(params.items())
+        return hashlib.sha1(json.dumps(items, ensure_ascii=False).encode("utf-8")).digest()
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        if entry[3] is not None:
+            # Ждущие повторы проснутся и обработают запрос сами
+            entry[3].set()
+
+    def _expire(self, now):
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry[0] > now:
+                return
+            self._drop(key)
+
+    def _put(self, key, entry):
+        self._entries.pop(key, None)
+        self._entries[key] = entry
+        while len(self._entries) > self.capacity:
+            self._drop(next(iter(self._entries)))
+
+    def claim(self, route, params):
+        """
+        Возвращает (ответ, ожидание). Ответ - запомненный ответ на такой же
+        запрос. Ожидание - threading.Event такого же запроса в работе: после
+        него claim() вызывается снова. (None, None) - ответа нет, и
+        вызывающий теперь владелец записи (если кэш для запроса включен).
+        """
+        trx_id = params.get("trx_id")
+        if not trx_id or not self.enabled:
+            return None, None
+        key = (route, trx_id)
+        fingerprint = self._fingerprint(params)
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] == fingerprint:
+                if entry[2] is not None:
+                    result, waiter = "hit", None
+                else:
+                    result, waiter = "wait", entry[3]
+            else:
+                result, waiter = "miss", None
+                # Другой запрос с тем же trx_id еще в работе - этот
+                # обрабатывается без записи в кэш, чтобы не отнять у
+                # ждущих их ответ
+                if entry is None or entry[2] is not None:
+                    self._put(key, (now + self.ttl, fingerprint, None, threading.Event()))
+        metrics.inc("gateway_idempotency_total", route=route, result=result)
+        return (entry[2] if result == "hit" else None), waiter
+
+    def lookup(self, route, params, timeout=PENDING_TIMEOUT):
+        """
+        Ранее отданный ответ на такой же запрос или None. Если такой же
+        запрос в работе, ждет его ответа не дольше timeout секунд.
+        """
+        body, waiter = self.claim(route, params)
+        if waiter is not None:
+            waiter.wait(timeout)
+            # Владелец ответил, отказался (release) или завис - в последних
+            # двух случаях запрос обрабатывается здесь
+            body, _ = self.claim(route, params)
+        return body
+
+    def store(self, route, params, body):
+        trx_id = params.get("trx_id")
+        if not trx_id or not self.enabled:
+            return
+        key = (route, trx_id)
+        fingerprint = self._fingerprint(params)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] is None and entry[1] != fingerprint:
+                return
+            if entry is not None:
+                self._drop(key)
+            self._put(key, (time.monotonic() + self.ttl, fingerprint, body, None))
+
+    def release(self, route, params):
+        """Снимает запись "в работе", если ответ так и не был сохранен."""
+        trx_id = params.get("trx_id")
+        if not trx_id or not self.enabled:
+            return
+        key = (route, trx_id)
+        fingerprint = self._fingerprint(params)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] is None and entry[1] == fingerprint:
+                self._drop(key)
+
+    def __len__(self):
+        return len(self._entries)
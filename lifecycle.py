@@ -0,0 +1,188 @@
+"""
+Сопоставление CPAReq и RPReq в жизненный цикл платежа.
+
+Каждый заказ проходит состояния created (заказ создан в тестере) ->
+checked (пришел CPAReq) -> registered (пришел RPReq) -> success/fail
+(по result_code). События применяются по одному, за O(1): счетчики
+переходов и сумма/минимум/максимум задержки от CPAReq до результата
+обновляются на месте, а не пересчитываются по истории.
+
+Коллбэки пишет api_server, а заказы создают воркеры tester - в разных
+процессах, поэтому трекер ничего не считает со слов своего процесса, а
+догоняет поисковый индекс по курсорам id (sync): сначала таблицу orders,
+затем коллбэки. Так счетчики одинаковы во всех воркерах и
+восстанавливаются после перезапуска. Журнал для этого не годится: в нем
+RPReq вытесняет CPAReq с тем же trx_id. Заказы, в том числе недавно завершенные
+(чтобы распознавать повторы банка), хранятся в окне capacity; самые
+давние вытесняются, чтобы память не росла.
+"""
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+STATES = ("created", "checked", "registered", "success", "fail")
+
+# Границы гистограммы задержки check -> результат, в секундах
+LATENCY_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 30, 60, 300, 600)
+
+def _parse_time(value):
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+class LifecycleTracker:
+    def __init__(self, capacity=10000):
+        self.capacity = capacity
+        self._flows = OrderedDict()
+        self._by_trx = {}
+        self._cursor = 0
+        self._order_cursor = 0
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self._flows.clear()
+        self._by_trx.clear()
+        self._cursor = 0
+        self._order_cursor = 0
+        self.in_flight = 0
+        self.reached = dict.fromkeys(STATES, 0)
+        # Потоки, дошедшие до этапа из предыдущего: только по ним считается
+        # конверсия. В reached попадают и заказы, созданные не в тестере,
+        # вытесненные из окна или пришедшие до заполнения orders
+        self.passed = {"checked": 0, "registered": 0}
+        self.duplicates = 0
+        self.latency_count = 0
+        self.latency_sum = 0.0
+        self.latency_min = None
+        self.latency_max = None
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def _flow(self, order_id, trx_id):
+        key = self._by_trx.get(trx_id) if trx_id else None
+        if key is None:
+            key = order_id or trx_id
+        flow = self._flows.get(key)
+        if flow is None:
+            flow = {"order_id": order_id, "trx_id": None, "state": None, "created": False, "checked_at": None}
+            self._flows[key] = flow
+            self.in_flight += 1
+            while len(self._flows) > self.capacity:
+                _, evicted = self._flows.popitem(last=False)
+                self._by_trx.pop(evicted["trx_id"], None)
+                if evicted["state"] not in ("success", "fail"):
+                    self.in_flight -= 1
+        if trx_id and flow["trx_id"] is None:
+            flow["trx_id"] = trx_id
+            self._by_trx[trx_id] = key
+        return flow
+
+    def _advance(self, flow, state):
+        # Повторы банка и события не по порядку не откатывают состояние
+        current = flow["state"]
+        if current is not None and STATES.index(current) >= STATES.index(state):
+            self.duplicates += 1
+            return False
+        flow["state"] = state
+        self.reached[state] += 1
+        return True
+
+    def _record_latency(self, seconds):
+        self.latency_count += 1
+        self.latency_sum += seconds
+        if self.latency_min is None or seconds < self.latency_min:
+            self.latency_min = seconds
+        if self.latency_max is None or seconds > self.latency_max:
+            self.latency_max = seconds
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.latency_buckets[i] += 1
+                return
+        self.latency_buckets[-1] += 1
+
+    def order_created(self, order_id):
+        """Применяет одну запись таблицы orders."""
+        with self._lock:
+            flow = self._flow(str(order_id), None)
+            # Заказ мог попасть в индекс позже своего CPAReq, если его
+            # создали между чтением orders и коллбэков в sync
+            if flow["state"] is None:
+                self._advance(flow, "created")
+            elif not flow["created"]:
+                self.reached["created"] += 1
+                self.passed["checked"] += 1
+            flow["created"] = True
+
+    def apply(self, record):
+        """Применяет одну запись журнала коллбэков."""
+        data = record.get("data", {})
+        params = data.get("raw_params", {})
+        trx_id = params.get("trx_id") or record.get("token")
+        order_id = params.get("o.order_id")
+        with self._lock:
+            flow = self._flow(order_id, trx_id)
+            if data.get("type") == "CPAReq":
+                if self._advance(flow, "checked"):
+                    flow["checked_at"] = _parse_time(record.get("timestamp"))
+                    if flow["created"]:
+                        self.passed["checked"] += 1
+            elif data.get("type") == "RPReq":
+                previous = flow["state"]
+                if not self._advance(flow, "registered"):
+                    return
+                if previous == "checked":
+                    self.passed["registered"] += 1
+                result = "success" if params.get("result_code") == "1" else "fail"
+                self._advance(flow, result)
+                self.in_flight -= 1
+                finished_at = _parse_time(record.get("timestamp"))
+                if flow["checked_at"] is not None and finished_at is not None:
+                    self._record_latency((finished_at - flow["checked_at"]).total_seconds())
+
+    def sync(self, index):
+        """Применяет записи, появившиеся в индексе с прошлого вызова."""
+        with self._sync_lock:
+            # Заказы раньше коллбэков: заказ создается до того, как банк
+            # пришлет по нему CPAReq
+            while True:
+                rows = index.orders_after(self._order_cursor)
+                if not rows:
+                    break
+                for row_id, order_id in rows:
+                    self.order_created(order_id)
+                    self._order_cursor = row_id
+            while True:
+                rows = index.after(self._cursor)
+                if not rows:
+                    return
+                for row_id, record in rows:
+                    self.apply(record)
+                    self._cursor = row_id
+
+    def stats(self):
+        with self._lock:
+            reached = dict(self.reached)
+            passed = self.passed
+            finished = reached["success"] + reached["fail"]
+            return {
+                "reached": reached,
+                "in_flight": self.in_flight,
+                "duplicates": self.duplicates,
+                "conversion": {
+                    "checked": _ratio(passed["checked"], reached["created"]),
+                    "registered": _ratio(passed["registered"], reached["checked"]),
+                    "success": _ratio(reached["success"], finished)
+                },
+                "latency": {
+                    "count": self.latency_count,
+                    "avg": _ratio(self.latency_sum, self.latency_count),
+                    "min": self.latency_min,
+                    "max": self.latency_max,
+                    "buckets": dict(zip([str(b) for b in LATENCY_BUCKETS] + ["+Inf"], self.latency_buckets))
+                }
+            }
+
+def _ratio(value, total):
+    return value / total if total else None
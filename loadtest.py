@@ -0,0 +1,320 @@
+"""
+Нагрузочный прогон api_server, имитирующий шлюз банка.
+
+Трафик берется из raw_params сохраненных коллбэков (callbacks.json или
+callbacks.jsonl) либо синтезируется с заданной долей AFT, рекуррентных
+платежей, регистраций карт и неуспешных RPReq. Запросы идут в
+api_server.app, поднятый на локальном порту (или на --url), из
+нескольких потоков. В конце печатаются p50/p99, пропускная способность
+и доля ошибок по каждому маршруту.
+
+Трафик гоняется по кругу, но шлюз отвечает на повтор trx_id из кэша
+идемпотентности, не сохраняя коллбэк. Поэтому в каждом следующем круге
+trx_id и номера заказов переписываются, и нагрузка остается нагрузкой
+на полную обработку. С --repeat-ids запросы повторяются как есть - так
+меряется именно путь ответа из кэша.
+
+Результат можно сохранить как базовый (--save-baseline) и сравнивать с
+ним последующие прогоны (--baseline): при ухудшении больше чем на
+--tolerance скрипт завершается с кодом 1.
+
+    python loadtest.py --requests 5000 --concurrency 16 --save-baseline baseline.json
+    python loadtest.py --from-callbacks callbacks.json --baseline baseline.json
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import random
+import shutil
+import string
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode, urlsplit
+
+CHECK_PATH = "/operation/check"
+CALLBACK_PATH = "/operation/callback"
+
+def load_recorded_traffic(path):
+    """Строит запросы из raw_params сохраненных CPAReq/RPReq."""
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            records = [json.loads(line) for line in f if line.strip()]
+        else:
+            records = json.load(f)
+
+    traffic = []
+    for record in records:
+        data = record.get("data", {})
+        params = data.get("raw_params")
+        if not params:
+            continue
+        if data.get("type") == "CPAReq":
+            traffic.append((CHECK_PATH, params))
+        elif data.get("type") == "RPReq":
+            traffic.append((CALLBACK_PATH, params))
+    return traffic
+
+def _random_token(rng, length=20):
+    return "".join(rng.choice(string.ascii_uppercase + string.digits) for _ in range(length))
+
+def synthesize_traffic(flows, aft=0.0, recurrent=0.0, card_registration=0.0, fail=0.0, seed=None):
+    """
+    Генерирует пары CPAReq + RPReq для flows заказов с заданными долями
+    AFT, рекуррентных платежей, регистраций карт и отказов.
+    """
+    rng = random.Random(seed)
+    traffic = []
+    for order_id in range(1, flows + 1):
+        trx_id = _random_token(rng)
+        check = {
+            "trx_id": trx_id,
+            "merch_id": "ECOM_CPA",
+            "o.order_id": str(order_id),
+            "ts": time.strftime("%Y%m%d %H:%M:%S")
+        }
+        callback = {
+            "trx_id": trx_id,
+            "merch_id": "ECOM_CPA",
+            "merchant_trx": str(order_id),
+            "o.order_id": str(order_id),
+            "result_code": "2" if rng.random() < fail else "1",
+            "amount": "10000",
+            "account_id": "MAIN",
+            "p.maskedPan": "424242xxxxxx4242",
+            "p.paymentSystem": "VISA"
+        }
+        if rng.random() < aft:
+            check["paymentId"] = "aft"
+            callback["paymentId"] = "aft"
+        if rng.random() < recurrent:
+            check["src.type"] = "card_id"
+            check["src.cardId"] = _random_token(rng, 12)
+            callback["card.id"] = check["src.cardId"]
+        elif rng.random() < card_registration:
+            callback["card.id"] = _random_token(rng, 12)
+            callback["card.registered"] = "Y"
+            callback["card.expiry"] = "2612"
+        traffic.append((CHECK_PATH, check))
+        traffic.append((CALLBACK_PATH, callback))
+    return traffic
+
+def prepare_data_dir(data_dir=None):
+    """
+    Направляет api_server на отдельный каталог данных, чтобы прогон не
+    засорял рабочие callbacks/cards. Вызывать до импорта api_server.
+    """
+    if data_dir is None:
+        data_dir = tempfile.mkdtemp(prefix="ecom_loadtest_")
+        source = os.path.join(os.path.dirname(os.path.abspath(__file__)), "settings.json")
+        if os.path.exists(source):
+            shutil.copy(source, data_dir)
+    os.makedirs(data_dir, exist_ok=True)
+    os.environ["ECOM_TESTER_DATA_DIR"] = data_dir
+    return data_dir
+
+def start_local_server():
+    """Поднимает api_server.app на свободном локальном порту в фоновом потоке."""
+    from werkzeug.serving import make_server
+    import api_server
+
+    # Журнал доступа werkzeug на каждый запрос искажал бы замеры
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, api_server.app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+ORDER_ID_FIELDS = ("o.order_id", "merchant_trx")
+
+def cycle_ids(traffic):
+    """
+    Функция (params, номер круга) -> params с уникальными для круга trx_id
+    и номерами заказов. Числовые номера сдвигаются на круг, умноженный на
+    степень десяти больше любого номера в traffic, и не пересекаются.
+    """
+    numeric = [int(params[field]) for _, params in traffic for field in ORDER_ID_FIELDS
+               if str(params.get(field, "")).isdigit()]
+    stride = 10 ** len(str(max(numeric, default=0)))
+
+    def rewrite(params, cycle):
+        if cycle == 0:
+            return params
+        params = dict(params)
+        if params.get("trx_id"):
+            params["trx_id"] = f"{params['trx_id']}-{cycle}"
+        for field in ORDER_ID_FIELDS:
+            value = str(params.get(field, ""))
+            if value.isdigit():
+                params[field] = str(int(value) + cycle * stride)
+            elif value:
+                params[field] = f"{value}-{cycle}"
+        return params
+
+    return rewrite
+
+def run_load(base_url, traffic, total_requests, concurrency, repeat_ids=False):
+    """
+    Прогоняет total_requests запросов по кругу из traffic. Без repeat_ids
+    каждый круг идет с новыми trx_id и номерами заказов (cycle_ids).
+    """
+    target = urlsplit(base_url)
+    local = threading.local()
+    latencies = {}
+    errors = {}
+    lock = threading.Lock()
+
+    def connection():
+        if getattr(local, "conn", None) is None:
+            local.conn = http.client.HTTPConnection(target.hostname, target.port, timeout=30)
+        return local.conn
+
+    def send(item):
+        path, params = item
+        url = f"{target.path.rstrip('/')}{path}?{urlencode(params)}"
+        started = time.perf_counter()
+        failed = False
+        try:
+            conn = connection()
+            conn.request("GET", url)
+            response = conn.getresponse()
+            response.read()
+            failed = response.status != 200
+            if response.getheader("Connection", "").lower() == "close" or response.version == 10:
+                conn.close()
+                local.conn = None
+        except Exception:
+            failed = True
+            local.conn = None
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.setdefault(path, []).append(elapsed)
+            if failed:
+                errors[path] = errors.get(path, 0) + 1
+
+    rewrite = cycle_ids(traffic)
+
+    def items():
+        for i in range(total_requests):
+            path, params = traffic[i % len(traffic)]
+            yield path, (params if repeat_ids else rewrite(params, i // len(traffic)))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(send, items()))
+    duration = time.perf_counter() - started
+
+    report = {"duration": duration, "routes": {}}
+    all_latencies = []
+    for path, values in latencies.items():
+        values.sort()
+        all_latencies.extend(values)
+        report["routes"][path] = summarize(values, errors.get(path, 0), duration)
+    all_latencies.sort()
+    report["total"] = summarize(all_latencies, sum(errors.values()), duration)
+    return report
+
+def summarize(sorted_latencies, error_count, duration):
+    count = len(sorted_latencies)
+    return {
+        "requests": count,
+        "errors": error_count,
+        "error_rate": error_count / count if count else 0.0,
+        "throughput": count / duration if duration else 0.0,
+        "p50_ms": percentile(sorted_latencies, 0.50) * 1000,
+        "p99_ms": percentile(sorted_latencies, 0.99) * 1000
+    }
+
+def print_report(report):
+    print(f"{'route':<22}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    rows = list(report["routes"].items()) + [("total", report["total"])]
+    for name, stats in rows:
+        print(f"{name:<22}{stats['requests']:>10}{stats['errors']:>8}{stats['throughput']:>10.0f}"
+              f"{stats['p50_ms']:>10.2f}{stats['p99_ms']:>10.2f}")
+
+def compare_with_baseline(report, baseline, tolerance):
+    """Возвращает список регрессий относительно базового прогона."""
+    regressions = []
+    for name, base in list(baseline["routes"].items()) + [("total", baseline["total"])]:
+        current = report["total"] if name == "total" else report["routes"].get(name)
+        if current is None:
+            continue
+        for key in ("p50_ms", "p99_ms"):
+            if current[key] > base[key] * (1 + tolerance):
+                regressions.append(f"{name} {key}: {base[key]:.2f} -> {current[key]:.2f}")
+        if current["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(f"{name} throughput: {base['throughput']:.0f} -> {current['throughput']:.0f}")
+        if current["error_rate"] > base["error_rate"] + 0.01:
+            regressions.append(f"{name} error_rate: {base['error_rate']:.3f} -> {current['error_rate']:.3f}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон api_server")
+    parser.add_argument("--url", help="адрес уже запущенного api_server; по умолчанию поднимается локальный")
+    parser.add_argument("--data-dir", help="каталог данных локального api_server; по умолчанию временный")
+    parser.add_argument("--from-callbacks", help="callbacks.json/.jsonl, из которого берется трафик")
+    parser.add_argument("--flows", type=int, default=500, help="число синтетических заказов")
+    parser.add_argument("--aft", type=float, default=0.2)
+    parser.add_argument("--recurrent", type=float, default=0.1)
+    parser.add_argument("--card-registration", type=float, default=0.1)
+    parser.add_argument("--fail", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--repeat-ids", action="store_true",
+                        help="не переписывать trx_id по кругам (замер ответов из кэша повторов)")
+    parser.add_argument("--save-baseline", help="сохранить результат как базовый")
+    parser.add_argument("--baseline", help="сравнить с базовым результатом")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое ухудшение, доля")
+    args = parser.parse_args(argv)
+
+    if args.from_callbacks:
+        traffic = load_recorded_traffic(args.from_callbacks)
+    else:
+        traffic = synthesize_traffic(args.flows, args.aft, args.recurrent,
+                                     args.card_registration, args.fail, args.seed)
+    if not traffic:
+        print("No traffic to replay", file=sys.stderr)
+        return 2
+
+    server = None
+    base_url = args.url
+    if not base_url:
+        prepare_data_dir(args.data_dir)
+        server, base_url = start_local_server()
+    try:
+        report = run_load(base_url, traffic, args.requests, args.concurrency, args.repeat_ids)
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    print_report(report)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(report, baseline, args.tolerance)
+        if regressions:
+            print("Regressions against baseline:", file=sys.stderr)
+            for line in regressions:
+                print(f"  {line}", file=sys.stderr)
+            return 1
+        print("No regressions against baseline")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
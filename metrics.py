@@ -0,0 +1,180 @@
+"""
+Метрики шлюза в текстовом формате Prometheus.
+
+Счетчики и гистограммы живут в памяти процесса. Наблюдение - это
+bisect по границам корзин и пара сложений под блокировкой, поэтому
+замеры можно оставлять включенными в бою. span() замеряет отдельный
+этап обработки запроса и пишет его в гистограмму
+gateway_stage_seconds{stage=...}.
+
+SamplingProfiler - выборочный профайлер одного запроса: фоновый поток
+через sys._current_frames() снимает стек потока запроса и копит его в
+свернутом виде (folded stacks), пригодном для flamegraph.pl и speedscope.
+"""
+import bisect
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# Границы корзин гистограмм, в секундах
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+# Интервал снятия стеков профайлером, в секундах
+PROFILE_INTERVAL = 0.0001
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+class Registry:
+    def __init__(self):
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def span(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("gateway_stage_seconds", time.perf_counter() - started, stage=stage)
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = [(key, list(h.counts), h.total, h.count)
+                          for key, h in sorted(self._histograms.items())]
+
+        lines = []
+        described = set()
+
+        def header(name, kind):
+            if name in described:
+                return
+            described.add(name)
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+
+        for (name, labels), counts, total, count in histograms:
+            header(name, "histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(list(BUCKETS) + ["+Inf"], counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+# Интервал переключения GIL общий на процесс: его сохраняет первый
+# запущенный профайлер и восстанавливает последний остановленный
+_switch_lock = threading.Lock()
+_switch_users = 0
+_switch_original = None
+
+def _lower_switch_interval(interval):
+    global _switch_users, _switch_original
+    with _switch_lock:
+        if _switch_users == 0:
+            _switch_original = sys.getswitchinterval()
+        _switch_users += 1
+        sys.setswitchinterval(min(interval, sys.getswitchinterval()))
+
+def _restore_switch_interval():
+    global _switch_users
+    with _switch_lock:
+        _switch_users -= 1
+        if _switch_users == 0:
+            sys.setswitchinterval(_switch_original)
+
+class SamplingProfiler:
+    """
+    Снимает стеки одного потока, пока не вызван stop(). На время сбора
+    интервал переключения GIL уменьшается до интервала выборки, иначе
+    поток профайлера получал бы управление раз в 5 мс и не видел бы
+    запросов короче этого.
+    """
+    def __init__(self, thread_id=None, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        _lower_switch_interval(self.interval)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.is_set():
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                return
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    def stop(self):
+        """Останавливает сбор и возвращает свернутые стеки текстом."""
+        self._stop.set()
+        self._thread.join()
+        _restore_switch_interval()
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+registry = Registry()
+registry.describe("gateway_request_seconds", "Request handling time by route")
+registry.describe("gateway_stage_seconds", "Time spent in request handling stages")
+registry.describe("gateway_cpa_requests_total", "CPAReq received, by AFT flag")
+registry.describe("gateway_rp_requests_total", "RPReq received, by result_code and AFT flag")
+
+inc = registry.inc
+observe = registry.observe
+span = registry.span
+render = registry.render
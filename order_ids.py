@@ -0,0 +1,57 @@
+"""
+Выдача номеров заказов, безопасная между процессами.
+
+Верхняя граница выданных номеров хранится в order_counter.txt. Каждый
+процесс резервирует себе сразу блок номеров: под flock читает границу,
+сдвигает ее на размер блока и атомарно (временный файл + fsync +
+os.replace) записывает обратно. Дальше номера из блока раздаются из
+памяти без обращения к диску и без межпроцессных блокировок.
+
+Граница сохраняется на диск до того, как номера из блока выданы, поэтому
+после падения процесса номера не повторяются - неиспользованный остаток
+блока просто пропадает.
+"""
+import os
+import threading
+
+try:
+    from .storage import atomic_write, file_lock
+except ImportError:
+    from storage import atomic_write, file_lock
+
+class OrderIdAllocator:
+    def __init__(self, path, block_size=20):
+        self.path = path
+        self.block_size = block_size
+        self._next = 0
+        self._end = 0
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _read_counter(self):
+        try:
+            with open(self.path, "r") as f:
+                return int(f.read().strip())
+        except FileNotFoundError:
+            return 0
+
+    def _reserve(self, count):
+        with file_lock(self.path):
+            start = self._read_counter() + 1
+            atomic_write(self.path, str(start + count - 1).encode("ascii"), durable=True)
+        return start, start + count
+
+    def reserve(self, count):
+        """Резервирует непрерывный диапазон из count номеров."""
+        start, end = self._reserve(count)
+        return range(start, end)
+
+    def next_id(self):
+        with self._lock:
+            # После fork блок родителя использовать нельзя - номера повторятся
+            if self._pid != os.getpid() or self._next >= self._end:
+                self._next, self._end = self._reserve(self.block_size)
+                self._pid = os.getpid()
+            order_id = self._next
+            self._next += 1
+            return order_id
@@ -0,0 +1,86 @@
+"""
+Запись коллбэков и карт, общая для api_server и blueprint'а tester.
+
+Модуль намеренно легкий: без Flask и без самого blueprint'а, чтобы шлюз
+мог один раз импортировать его при старте. Пути берутся из tester_config.
+"""
+try:
+    from .callback_archive import CallbackArchive
+    from .callback_index import CallbackIndex
+    from .callback_store import CallbackStore
+    from .card_registry import CardRegistry
+    from .tester_config import (CALLBACKS_ARCHIVE, CALLBACKS_COMMIT_DELAY_MS, CALLBACKS_FILE, CALLBACKS_INDEX,
+                                CALLBACKS_LOG, CALLBACKS_RETENTION, CARDS_CAPACITY, CARDS_FILE)
+except ImportError:
+    # Импорт из api_server, где каталог tester просто добавлен в sys.path
+    from callback_archive import CallbackArchive
+    from callback_index import CallbackIndex
+    from callback_store import CallbackStore
+    from card_registry import CardRegistry
+    from tester_config import (CALLBACKS_ARCHIVE, CALLBACKS_COMMIT_DELAY_MS, CALLBACKS_FILE, CALLBACKS_INDEX,
+                               CALLBACKS_LOG, CALLBACKS_RETENTION, CARDS_CAPACITY, CARDS_FILE)
+
+# Вытесненные из окна журнала коллбэки уходят в сжатый архив по дням
+callback_archive = CallbackArchive(CALLBACKS_ARCHIVE)
+callback_store = CallbackStore(CALLBACKS_LOG, CALLBACKS_RETENTION, legacy_path=CALLBACKS_FILE,
+                               on_evict=callback_archive.append,
+                               commit_delay=CALLBACKS_COMMIT_DELAY_MS / 1000)
+# Полная история для поиска; при создании наполняется из журнала
+callback_index = CallbackIndex(CALLBACKS_INDEX, backfill=callback_store.all)
+card_registry = CardRegistry(CARDS_FILE, CARDS_CAPACITY)
+
+def load_cards():
+    try:
+        return card_registry.all()
+    except Exception as e:
+        return []
+
+def save_card(card_data):
+    try:
+        card_registry.add(card_data)
+    except Exception as e:
+        pass
+
+def save_orders(order_ids):
+    # Созданные заказы нужны только для статистики воронки
+    try:
+        callback_index.add_orders(order_ids)
+    except Exception as e:
+        pass
+
+def load_callbacks():
+    try:
+        return callback_store.all()
+    except Exception:
+        return []
+
+def save_callback(token, data):
+    save_callbacks([(token, data)])
+
+def save_callbacks(items):
+    """
+    Сохраняет пачку коллбэков [(token, data)] одной записью в журнал.
+    Ошибки записи пробрасываются - их логирует вызывающий.
+    """
+    records = callback_store.append_many(items)
+    try:
+        callback_index.add_many(records)
+    except Exception as e:
+        # Коллбэки уже в журнале; без индекса они просто не найдутся поиском
+        pass
+
+    for token, data in items:
+        if data.get("type") != "RPReq":
+            continue
+        raw_params = data.get("raw_params", {})
+        card_id = raw_params.get("card.id")
+
+        if card_id:
+            card_data = {
+                "card_id": card_id,
+                "masked_pan": raw_params.get("p.maskedPan", ""),
+                "expiry": raw_params.get("card.expiry", ""),
+                "payment_system": raw_params.get("p.paymentSystem", ""),
+                "registered": raw_params.get("card.registered", "N")
+            }
+            save_card(card_data)
@@ -0,0 +1,361 @@
+"""
+Локальная замена платежной страницы банка для сквозных прогонов.
+
+Берет ссылки initiation_link, которые выдает tester (/create_orders),
+и для каждой проходит путь банка: CPAReq на /operation/check, разбор
+payment-avail-response, затем RPReq на /operation/callback с заданными
+result_code, card.id и p.maskedPan. Потоки оплаты идут параллельно из
+пула потоков.
+
+Ссылки берутся из файла (--links: по ссылке на строку или NDJSON-вывод
+/create_orders), из запущенного tester (--tester-url) или из tester,
+поднятого в этом же процессе. Шлюз - запущенный api_server (--url) или
+локальный на 127.0.0.1, так что сеть не нужна. Для локального шлюза в
+конце проверяется, что последний сохраненный коллбэк каждого заказа -
+наш RPReq, а для локального tester выводится его /stats.
+
+    python pga_simulator.py --orders 5000 --concurrency 32
+    python pga_simulator.py --orders 200 --order-data '{"aftEnabled": true}' --result-code 2
+    python pga_simulator.py --links links.ndjson --url http://127.0.0.1:7443
+"""
+import argparse
+import http.client
+import importlib
+import itertools
+import json
+import os
+import random
+import string
+import sys
+import threading
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from loadtest import CALLBACK_PATH, CHECK_PATH, prepare_data_dir, print_report, start_local_server, summarize
+
+# Ссылок за один вызов /create_orders (MAX_BATCH_ORDERS в tester)
+CREATE_BATCH_SIZE = 1000
+
+def parse_initiation_link(link):
+    """(платежная страница, параметры) из ссылки initiation_link."""
+    parts = urlsplit(link.strip())
+    return parts.path.strip("/"), dict(parse_qsl(parts.query, keep_blank_values=True))
+
+def parse_avail_response(body):
+    """Поля payment-avail-response, нужные банку для продолжения оплаты."""
+    root = ET.fromstring(body)
+    if root.tag != "payment-avail-response":
+        raise ValueError(f"unexpected response root <{root.tag}>")
+    return {
+        "code": root.findtext("result/code"),
+        "desc": root.findtext("result/desc"),
+        "merchant_trx": root.findtext("merchant-trx"),
+        "account_id": root.findtext("purchase/account-amount/id"),
+        "amount": root.findtext("purchase/account-amount/amount"),
+        "currency": root.findtext("purchase/account-amount/currency"),
+        "transaction_type": root.findtext("transaction-type"),
+        "mir_extension": root.find("mir-extension") is not None
+    }
+
+def parse_register_response(body):
+    return ET.fromstring(body).findtext("result/code")
+
+def read_links(path):
+    """Ссылки из файла: по одной на строку или NDJSON с initiation_link."""
+    links = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                line = json.loads(line).get("initiation_link", "")
+            if line:
+                links.append(line)
+    return links
+
+def create_links(post, orders, order_data, matrix):
+    """
+    Заказывает ссылки у tester через /create_orders. post(path, body) -
+    функция, возвращающая текст ответа. Каждая комбинация matrix
+    запрашивается отдельным пакетом с нужным числом повторов.
+    """
+    keys = list(matrix)
+    combinations = list(itertools.product(*(matrix[key] for key in keys))) or [()]
+    links = []
+    for i, values in enumerate(combinations):
+        # Заказы делятся между комбинациями поровну, остаток - первым
+        count = orders // len(combinations) + (1 if i < orders % len(combinations) else 0)
+        base = dict(order_data, **dict(zip(keys, values)))
+        while count > 0:
+            batch = min(count, CREATE_BATCH_SIZE)
+            text = post("/create_orders", {"base": base, "matrix": {}, "repeat": batch})
+            for line in text.splitlines():
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                if "initiation_link" not in item:
+                    raise RuntimeError(f"/create_orders failed: {item.get('error', line)}")
+                links.append(item["initiation_link"])
+            count -= batch
+    return links
+
+def local_tester_client():
+    """
+    Тестовый клиент Flask-приложения с blueprint tester из этого каталога.
+    Пакет импортируется по имени каталога, поэтому данные он берет из
+    того же ECOM_TESTER_DATA_DIR, что и api_server.
+    """
+    from flask import Flask
+
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    parent = os.path.dirname(package_dir)
+    if parent not in sys.path:
+        sys.path.insert(0, parent)
+    package = importlib.import_module(os.path.basename(package_dir))
+    app = Flask(__name__)
+    app.register_blueprint(package.tester_bp)
+    return app.test_client()
+
+def http_post(base_url):
+    target = urlsplit(base_url)
+
+    def post(path, body):
+        conn = http.client.HTTPConnection(target.hostname, target.port, timeout=60)
+        try:
+            conn.request("POST", f"{target.path.rstrip('/')}{path}", json.dumps(body),
+                         {"Content-Type": "application/json"})
+            return conn.getresponse().read().decode("utf-8")
+        finally:
+            conn.close()
+    return post
+
+def _random_token(rng, length=12):
+    return "".join(rng.choice(string.ascii_uppercase + string.digits) for _ in range(length))
+
+class PaymentPageSimulator:
+    """
+    Платежная страница: проводит заказ по ссылке через шлюз. card_id=None -
+    карта выдается только там, где она нужна: src.cardId рекуррентного
+    платежа или новая карта на странице регистрации pages-rec.
+    """
+    def __init__(self, base_url, result_code="1", card_id=None,
+                 masked_pan="424242xxxxxx4242", payment_system="VISA", seed=None):
+        self.target = urlsplit(base_url)
+        self.result_code = result_code
+        self.card_id = card_id
+        self.masked_pan = masked_pan
+        self.payment_system = payment_system
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self._local = threading.local()
+
+    def _token(self, length):
+        with self._rng_lock:
+            return _random_token(self._rng, length)
+
+    def _get(self, path, params):
+        url = f"{self.target.path.rstrip('/')}{path}?{urlencode(params)}"
+        for attempt in (1, 2):
+            conn = getattr(self._local, "conn", None)
+            if conn is None:
+                conn = self._local.conn = http.client.HTTPConnection(self.target.hostname, self.target.port, timeout=30)
+            try:
+                conn.request("GET", url)
+                response = conn.getresponse()
+                body = response.read()
+            except (http.client.HTTPException, OSError):
+                # Соединение закрыто сервером - повторяем на новом
+                conn.close()
+                self._local.conn = None
+                if attempt == 2:
+                    raise
+                continue
+            if response.getheader("Connection", "").lower() == "close" or response.version == 10:
+                conn.close()
+                self._local.conn = None
+            return response.status, body
+
+    def callback_params(self, page, link_params, avail, trx_id):
+        """Параметры RPReq, как их отправил бы банк после оплаты."""
+        params = {
+            "trx_id": trx_id,
+            "merch_id": link_params.get("merch_id", ""),
+            "merchant_trx": avail["merchant_trx"] or link_params.get("o.order_id", ""),
+            "o.order_id": link_params.get("o.order_id", ""),
+            "result_code": self.result_code,
+            "amount": avail["amount"] or "",
+            "account_id": avail["account_id"] or "",
+            "p.maskedPan": self.masked_pan,
+            "p.paymentSystem": self.payment_system,
+            "ts": time.strftime("%Y%m%d %H:%M:%S")
+        }
+        if link_params.get("paymentId"):
+            params["paymentId"] = link_params["paymentId"]
+        card_id = self.card_id or link_params.get("src.cardId")
+        if page == "pages-rec":
+            params["card.id"] = card_id or self._token(12)
+            params["card.registered"] = "Y"
+            params["card.expiry"] = "2612"
+        elif card_id:
+            params["card.id"] = card_id
+        return params
+
+    def run_flow(self, link):
+        """
+        Проводит один заказ. Возвращает (order_id, trx_id, время CPAReq,
+        время RPReq, ошибка или None).
+        """
+        page, link_params = parse_initiation_link(link)
+        order_id = link_params.get("o.order_id", "")
+        trx_id = self._token(20)
+        check_time = callback_time = None
+        try:
+            started = time.perf_counter()
+            status, body = self._get(CHECK_PATH, dict(link_params, trx_id=trx_id))
+            check_time = time.perf_counter() - started
+            if status != 200:
+                return order_id, trx_id, check_time, None, f"CPAReq HTTP {status}"
+            avail = parse_avail_response(body)
+            if avail["code"] != "1":
+                return order_id, trx_id, check_time, None, f"CPAReq result code {avail['code']}"
+            if avail["merchant_trx"] != order_id:
+                return order_id, trx_id, check_time, None, f"merchant-trx {avail['merchant_trx']} != {order_id}"
+
+            started = time.perf_counter()
+            status, body = self._get(CALLBACK_PATH, self.callback_params(page, link_params, avail, trx_id))
+            callback_time = time.perf_counter() - started
+            if status != 200:
+                return order_id, trx_id, check_time, callback_time, f"RPReq HTTP {status}"
+            expected = "1" if self.result_code == "1" else "2"
+            code = parse_register_response(body)
+            if code != expected:
+                return order_id, trx_id, check_time, callback_time, f"RPReq result code {code}, expected {expected}"
+        except Exception as e:
+            return order_id, trx_id, check_time, callback_time, f"{type(e).__name__}: {e}"
+        return order_id, trx_id, check_time, callback_time, None
+
+def run_flows(simulator, links, concurrency):
+    """Прогоняет все ссылки и собирает отчет в формате loadtest."""
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(simulator.run_flow, links))
+    duration = time.perf_counter() - started
+
+    checks = sorted(r[2] for r in results if r[2] is not None)
+    callbacks = sorted(r[3] for r in results if r[3] is not None)
+    flows = sorted(r[2] + r[3] for r in results if r[2] is not None and r[3] is not None)
+    failures = [r for r in results if r[4] is not None]
+    check_errors = sum(1 for r in failures if r[3] is None)
+    report = {
+        "duration": duration,
+        "routes": {
+            CHECK_PATH: summarize(checks, check_errors, duration),
+            CALLBACK_PATH: summarize(callbacks, len(failures) - check_errors, duration)
+        },
+        "results": results
+    }
+    report["total"] = summarize(flows, len(failures), duration)
+    # В итоговой строке - завершенные потоки оплаты, а не отдельные запросы
+    report["total"]["requests"] = len(results)
+    report["total"]["throughput"] = len(results) / duration if duration else 0.0
+    report["total"]["error_rate"] = len(failures) / len(results) if results else 0.0
+    return report
+
+def verify_persisted(results, result_code):
+    """
+    Для локального шлюза: последний коллбэк каждого успешного потока в
+    индексе - наш RPReq. Возвращает список расхождений.
+    """
+    import persistence
+
+    problems = []
+    for order_id, trx_id, _, _, error in results:
+        if error is not None:
+            continue
+        record = persistence.callback_index.get(trx_id)
+        if record is None:
+            problems.append(f"{order_id}: no callback stored for {trx_id}")
+            continue
+        data = record.get("data", {})
+        raw_params = data.get("raw_params", {})
+        if data.get("type") != "RPReq" or raw_params.get("result_code") != result_code \
+                or raw_params.get("o.order_id") != order_id:
+            problems.append(f"{order_id}: stored {data.get('type')} with result_code {raw_params.get('result_code')}")
+    return problems
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сквозные потоки оплаты через локальную платежную страницу")
+    parser.add_argument("--url", help="адрес запущенного api_server; по умолчанию поднимается локальный")
+    parser.add_argument("--data-dir", help="каталог данных локальных api_server и tester; по умолчанию временный")
+    parser.add_argument("--links", help="файл со ссылками initiation_link (по строке или NDJSON /create_orders)")
+    parser.add_argument("--tester-url", help="адрес tester, у которого заказываются ссылки")
+    parser.add_argument("--orders", type=int, default=1000, help="сколько заказов создать в tester")
+    parser.add_argument("--order-data", default="{}", help="JSON с полями /create_order для всех заказов")
+    parser.add_argument("--matrix", default="{}", help='JSON-матрица полей, например {"aftEnabled": [true, false]}')
+    parser.add_argument("--result-code", default="1", help="result_code в RPReq")
+    parser.add_argument("--card-id", help="card.id в RPReq; по умолчанию только для рекуррентных и регистраций")
+    parser.add_argument("--masked-pan", default="424242xxxxxx4242", help="p.maskedPan в RPReq")
+    parser.add_argument("--payment-system", default="VISA", help="p.paymentSystem в RPReq")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--show-failures", type=int, default=5, help="сколько неудачных потоков показать")
+    args = parser.parse_args(argv)
+
+    local = not args.url
+    if local or not (args.links or args.tester_url):
+        prepare_data_dir(args.data_dir)
+
+    tester = None
+    if args.links:
+        links = read_links(args.links)
+    else:
+        order_data = json.loads(args.order_data)
+        matrix = json.loads(args.matrix)
+        if args.tester_url:
+            post = http_post(args.tester_url)
+        else:
+            tester = local_tester_client()
+
+            def post(path, body):
+                return tester.post(path, json=body).get_data(as_text=True)
+        links = create_links(post, args.orders, order_data, matrix)
+    if not links:
+        print("No initiation links to pay", file=sys.stderr)
+        return 2
+
+    server = None
+    base_url = args.url
+    if local:
+        server, base_url = start_local_server()
+    simulator = PaymentPageSimulator(base_url, args.result_code, args.card_id,
+                                     args.masked_pan, args.payment_system, args.seed)
+    try:
+        report = run_flows(simulator, links, args.concurrency)
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    # В строке total - потоки оплаты целиком (CPAReq + RPReq)
+    print_report(report)
+    failures = [r for r in report["results"] if r[4] is not None]
+    for order_id, trx_id, _, _, error in failures[:args.show_failures]:
+        print(f"order {order_id} trx {trx_id}: {error}", file=sys.stderr)
+
+    problems = verify_persisted(report["results"], args.result_code) if local else []
+    for line in problems[:args.show_failures]:
+        print(line, file=sys.stderr)
+    if tester is not None:
+        stats = tester.get("/stats").get_json().get("stats", {})
+        print("tester stats:", json.dumps({key: stats.get(key) for key in ("reached", "in_flight", "duplicates")}))
+
+    if failures or problems:
+        print(f"Failed flows: {len(failures)}, persistence mismatches: {len(problems)}", file=sys.stderr)
+        return 1
+    print(f"All {len(links)} flows completed")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,147 @@
+"""
+Именованные профили настроек и выбор профиля для запроса шлюза.
+
+Профили лежат в том же settings.json: верхний уровень - профиль
+default, а в "profiles" для каждого имени хранятся только отличающиеся
+поля. Правила выбора профиля задаются в "profileRouting":
+
+    "profiles": {"qa1": {"amount": 500, "aftEnabled": true}},
+    "profileRouting": {
+        "merch_id": {"ECOM_QA1": "qa1"},
+        "orderRanges": [{"from": 1000, "to": 1999, "profile": "qa1"}]
+    }
+
+Профиль запроса определяется по порядку: явный o.profile (или profile)
+в параметрах, затем merch_id, затем диапазон номеров заказа. Таблица
+маршрутизации и слитые настройки профилей строятся один раз на версию
+настроек; сам выбор - поиск в словаре. Для диапазонов, если вместе они
+покрывают не больше DIRECT_LOOKUP_LIMIT номеров (обычный случай для
+тестовых блоков), строится прямая таблица номер -> профиль и поиск
+стоит O(1); для разреженных диапазонов на миллионы номеров такая
+таблица слишком велика, и остается bisect по отсортированным началам -
+O(log n) по числу диапазонов.
+
+Диапазоны могут быть вложенными ("orderRanges": весь блок 1000-1999 на
+qa1, а 1500-1599 внутри него - на qa2): номер получает профиль самого
+узкого диапазона, который его содержит. Для этого при компиляции
+диапазоны разрезаются на непересекающиеся отрезки, из которых и
+строится таблица (или список для bisect).
+"""
+import bisect
+import threading
+
+DEFAULT_PROFILE = "default"
+
+# Наибольший охват диапазонов, для которого строится прямая таблица
+DIRECT_LOOKUP_LIMIT = 65536
+
+def profile_settings(settings, name):
+    """Настройки профиля name поверх профиля по умолчанию."""
+    overrides = settings.get("profiles", {}).get(name) if name != DEFAULT_PROFILE else None
+    if not isinstance(overrides, dict):
+        return settings
+    merged = dict(settings)
+    merged.update(overrides)
+    return merged
+
+def _flatten_ranges(rules):
+    """
+    Разрезает диапазоны [(from, to, профиль)] на непересекающиеся отрезки,
+    каждому из которых достается профиль самого узкого накрывающего его
+    диапазона (при равной ширине - правила, указанного раньше).
+    """
+    bounds = sorted({start for start, _, _ in rules} | {end + 1 for _, end, _ in rules})
+    ranges = []
+    for lo, hi in zip(bounds, bounds[1:]):
+        covering = [(end - start, i, name) for i, (start, end, name) in enumerate(rules)
+                    if start <= lo and hi - 1 <= end]
+        if not covering:
+            continue
+        name = min(covering)[2]
+        if ranges and ranges[-1][1] == lo - 1 and ranges[-1][2] == name:
+            ranges[-1] = (ranges[-1][0], hi - 1, name)
+        else:
+            ranges.append((lo, hi - 1, name))
+    return ranges
+
+def _direct_table(ranges):
+    """(первый номер, профиль для каждого номера подряд) или None, если охват велик."""
+    if not ranges or ranges[-1][1] - ranges[0][0] >= DIRECT_LOOKUP_LIMIT:
+        return None
+    base = ranges[0][0]
+    names = [None] * (ranges[-1][1] - base + 1)
+    for start, end, name in ranges:
+        names[start - base:end - base + 1] = [name] * (end - start + 1)
+    return base, names
+
+class ProfileRouter:
+    def __init__(self, settings_store):
+        self.settings_store = settings_store
+        # (version, profiles, merch_id -> профиль, начала диапазонов, диапазоны,
+        # прямая таблица (первый номер, [профиль или None]) или None)
+        self._table = (None, {}, {}, [], [], None)
+        self._lock = threading.Lock()
+
+    def _compile(self, settings, version):
+        profiles = {DEFAULT_PROFILE: settings}
+        for name in settings.get("profiles", {}):
+            profiles[name] = profile_settings(settings, name)
+
+        routing = settings.get("profileRouting", {})
+        by_merchant = {merch_id: name for merch_id, name in routing.get("merch_id", {}).items()
+                       if name in profiles}
+        rules = []
+        for rule in routing.get("orderRanges", []):
+            try:
+                start, end, name = int(rule["from"]), int(rule["to"]), rule["profile"]
+            except (KeyError, TypeError, ValueError):
+                continue
+            if start <= end and name in profiles:
+                rules.append((start, end, name))
+        ranges = _flatten_ranges(rules)
+        return (version, profiles, by_merchant, [start for start, _, _ in ranges], ranges, _direct_table(ranges))
+
+    def table(self):
+        settings, version = self.settings_store.snapshot()
+        table = self._table
+        if table[0] == version:
+            return table
+        with self._lock:
+            if self._table[0] != version:
+                self._table = self._compile(settings, version)
+            return self._table
+
+    def snapshot(self, name=DEFAULT_PROFILE):
+        """Согласованная пара (настройки профиля, версия настроек)."""
+        version, profiles = self.table()[:2]
+        return profiles.get(name) or profiles[DEFAULT_PROFILE], version
+
+    def names(self):
+        return list(self.table()[1])
+
+    def resolve(self, params):
+        """Имя профиля для запроса с параметрами params."""
+        _, profiles, by_merchant, starts, ranges, direct = self.table()
+
+        name = params.get("o.profile") or params.get("profile")
+        if name in profiles:
+            return name
+
+        name = by_merchant.get(params.get("merch_id"))
+        if name is not None:
+            return name
+
+        if ranges:
+            try:
+                order_id = int(params.get("o.order_id") or "")
+            except ValueError:
+                return DEFAULT_PROFILE
+            if direct is not None:
+                offset = order_id - direct[0]
+                if 0 <= offset < len(direct[1]):
+                    return direct[1][offset] or DEFAULT_PROFILE
+                return DEFAULT_PROFILE
+            i = bisect.bisect_right(starts, order_id) - 1
+            if i >= 0 and order_id <= ranges[i][1]:
+                return ranges[i][2]
+        return DEFAULT_PROFILE
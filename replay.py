@@ -0,0 +1,103 @@
+"""
+Воспроизведение трафика, записанного шлюзом (GATEWAY_CAPTURE_FILE).
+
+Записанные запросы прогоняются через api_server.app в этом же процессе,
+без сети, и каждый ответ сравнивается с записанным байт в байт. Снимки
+настроек из файла захвата применяются по ходу, так что результат не
+зависит от текущего settings.json. Коллбэки пишутся в отдельный каталог
+данных (--data-dir, по умолчанию временный).
+
+Темп задается --speed: 1 - как в записи, N - в N раз быстрее,
+max - без пауз (замер пропускной способности). При расхождениях
+скрипт завершается с кодом 1.
+
+    python replay.py capture.jsonl.gz --speed max
+    python replay.py capture.jsonl.gz --speed 10 --show-diffs 5
+"""
+import argparse
+import difflib
+import os
+import sys
+import time
+
+from loadtest import prepare_data_dir, print_report, summarize
+from traffic_capture import read_capture
+
+def replay(path, speed=None, show_diffs=3):
+    """
+    Прогоняет файл захвата. speed=None - без пауз. Возвращает отчет
+    с задержками по маршрутам и числом расхождений.
+    """
+    import api_server
+
+    client = api_server.app.test_client()
+    latencies = {}
+    mismatches = {}
+    diffs = []
+    first_time = None
+    started = time.perf_counter()
+
+    for entry in read_capture(path):
+        if entry["kind"] == "settings":
+            api_server.settings_store.save(entry["settings"])
+            continue
+
+        if speed is not None:
+            if first_time is None:
+                first_time = entry["time"]
+            delay = (entry["time"] - first_time) / speed - (time.perf_counter() - started)
+            if delay > 0:
+                time.sleep(delay)
+
+        route = entry["path"]
+        request_started = time.perf_counter()
+        response = client.open(route, method=entry["method"], query_string=entry["query"])
+        latencies.setdefault(route, []).append(time.perf_counter() - request_started)
+
+        body = response.get_data(as_text=True)
+        if response.status_code != entry["status"] or body != entry["response"]:
+            mismatches[route] = mismatches.get(route, 0) + 1
+            if len(diffs) < show_diffs:
+                diffs.append("".join(difflib.unified_diff(
+                    entry["response"].splitlines(keepends=True), body.splitlines(keepends=True),
+                    f"recorded {route}", f"replayed {route}"
+                )) or f"{route}: status {entry['status']} -> {response.status_code}\n")
+
+    duration = time.perf_counter() - started
+    report = {"duration": duration, "routes": {}, "mismatches": mismatches, "diffs": diffs}
+    all_latencies = []
+    for route, values in latencies.items():
+        values.sort()
+        all_latencies.extend(values)
+        report["routes"][route] = summarize(values, mismatches.get(route, 0), duration)
+    all_latencies.sort()
+    report["total"] = summarize(all_latencies, sum(mismatches.values()), duration)
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Воспроизведение записанного трафика шлюза")
+    parser.add_argument("capture", help="файл захвата GATEWAY_CAPTURE_FILE")
+    parser.add_argument("--speed", default="max", help="1 - темп записи, N - в N раз быстрее, max - без пауз")
+    parser.add_argument("--data-dir", help="каталог данных api_server; по умолчанию временный")
+    parser.add_argument("--show-diffs", type=int, default=3, help="сколько расхождений показать")
+    args = parser.parse_args(argv)
+
+    speed = None if args.speed == "max" else float(args.speed)
+    # Воспроизведение не должно само попадать в захват
+    os.environ.pop("GATEWAY_CAPTURE_FILE", None)
+    prepare_data_dir(args.data_dir)
+
+    report = replay(args.capture, speed, args.show_diffs)
+
+    # В столбце errors - число ответов, отличающихся от записанных
+    print_report(report)
+    for diff in report["diffs"]:
+        print(diff, file=sys.stderr)
+    if report["mismatches"]:
+        print(f"Responses differ from the capture: {sum(report['mismatches'].values())}", file=sys.stderr)
+        return 1
+    print("All responses match the capture")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
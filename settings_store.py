@@ -0,0 +1,84 @@
+"""
+Общее хранилище настроек для blueprint'а tester и api_server.
+
+Держит разобранный settings.json в памяти и перечитывает файл только
+когда меняется его mtime/inode/размер или когда настройки сохраняются
+через save(). Счетчик version растет при каждой перезагрузке, так что
+вызывающий код может понять, что его копия настроек устарела.
+"""
+import json
+import logging
+import threading
+
+try:
+    from .storage import atomic_write_json, file_lock, file_stamp
+except ImportError:
+    from storage import atomic_write_json, file_lock, file_stamp
+
+log = logging.getLogger(__name__)
+
+
+class SettingsStore:
+    def __init__(self, path, defaults):
+        self.path = path
+        self.defaults = defaults
+        # (settings, version) публикуются одним кортежем, чтобы читатель
+        # без блокировки не получил настройки от одной версии, а номер от другой
+        self._current = (None, 0)
+        self._stamp = None
+        self._lock = threading.Lock()
+
+    @property
+    def version(self):
+        return self._current[1]
+
+    def get(self):
+        """
+        Возвращает текущие настройки. Результат общий для всех
+        вызывающих - его нельзя изменять на месте.
+        """
+        return self.snapshot()[0]
+
+    def snapshot(self):
+        """Возвращает согласованную пару (settings, version)."""
+        stamp = file_stamp(self.path)
+        current = self._current
+        if current[0] is not None and stamp == self._stamp:
+            return current
+
+        with self._lock:
+            # Другой поток мог успеть перечитать файл, пока мы ждали
+            current = self._current
+            if current[0] is not None and stamp == self._stamp:
+                return current
+            self._current = (self._read(stamp), current[1] + 1)
+            self._stamp = stamp
+            return self._current
+
+    def _read(self, stamp):
+        if stamp is None:
+            log.warning("Settings file not found at %s, using defaults", self.path)
+            return dict(self.defaults)
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                settings = json.load(f)
+            log.info("Reloaded settings from %s", self.path)
+            return settings
+        except Exception as e:
+            log.warning("Error loading settings: %s", e)
+            return dict(self.defaults)
+
+    def save(self, settings):
+        """
+        Записывает настройки во временный файл и атомарно подменяет
+        settings.json, после чего сразу публикует новую версию.
+        """
+        with self._lock, file_lock(self.path):
+            atomic_write_json(self.path, settings, indent=4)
+            self._current = (settings, self._current[1] + 1)
+            self._stamp = file_stamp(self.path)
+
+    def is_current(self, version):
+        """Проверяет, что настройки версии version все еще актуальны."""
+        self.get()
+        return version == self.version
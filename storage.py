@@ -0,0 +1,66 @@
+"""
+Общие примитивы файлового хранения для всех хранилищ tester.
+
+file_lock - advisory-блокировка (flock) на отдельном .lock-файле, общая
+для процессов api_server и tester. atomic_write/atomic_write_json пишут
+во временный файл рядом и подменяют целевой через os.replace, так что
+читатель видит либо старую, либо новую версию, но не половину файла.
+С durable=True данные и сама подмена еще и сбрасываются на диск.
+"""
+import fcntl
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+def lock_path(path):
+    return f"{path}.lock"
+
+@contextmanager
+def file_lock(path, shared=False):
+    """Держит flock на path.lock, пока открыт блок with."""
+    with open(lock_path(path), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        yield
+
+def file_stamp(path):
+    """(inode, mtime, размер) файла или None - признак того, что он изменился."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+def temp_path(path):
+    # Свой временный файл у каждого процесса и потока
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+def fsync_dir(path):
+    dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+def atomic_write(path, data, durable=False):
+    """Атомарно заменяет содержимое path байтами data."""
+    tmp_path = temp_path(path)
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            if durable:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    if durable:
+        # fsync каталога, чтобы сама подмена файла пережила падение
+        fsync_dir(path)
+
+def atomic_write_json(path, value, indent=2, durable=False):
+    atomic_write(path, json.dumps(value, ensure_ascii=False, indent=indent).encode("utf-8"), durable)
@@ -0,0 +1,24 @@
+"""
+Пути к файлам данных, общие для blueprint'а tester и api_server.
+
+По умолчанию все файлы лежат рядом с модулями tester. Каталог задается
+переменной ECOM_TESTER_DATA_DIR, отдельные файлы - своими переменными.
+"""
+import os
+
+DATA_DIR = os.environ.get("ECOM_TESTER_DATA_DIR", os.path.dirname(os.path.abspath(__file__)))
+
+def data_path(env_name, filename):
+    return os.environ.get(env_name, os.path.join(DATA_DIR, filename))
+
+SETTINGS_PATH = data_path("ECOM_TESTER_SETTINGS", "settings.json")
+CALLBACKS_FILE = data_path("ECOM_TESTER_CALLBACKS", "callbacks.json")
+CALLBACKS_LOG = data_path("ECOM_TESTER_CALLBACKS_LOG", "callbacks.jsonl")
+CALLBACKS_INDEX = data_path("ECOM_TESTER_CALLBACKS_INDEX", "callbacks.sqlite3")
+CALLBACKS_ARCHIVE = data_path("ECOM_TESTER_CALLBACKS_ARCHIVE", "callbacks_archive")
+CALLBACKS_RETENTION = int(os.environ.get("ECOM_TESTER_CALLBACKS_RETENTION", "50"))
+# Сколько миллисекунд первый коллбэк пачки ждет попутчиков перед записью
+CALLBACKS_COMMIT_DELAY_MS = float(os.environ.get("ECOM_TESTER_CALLBACKS_COMMIT_DELAY_MS", "0"))
+CARDS_FILE = data_path("ECOM_TESTER_CARDS", "cards.json")
+CARDS_CAPACITY = int(os.environ.get("ECOM_TESTER_CARDS_CAPACITY", "50"))
+ORDER_COUNTER_FILE = data_path("ECOM_TESTER_ORDER_COUNTER", "order_counter.txt")
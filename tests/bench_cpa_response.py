@@ -0,0 +1,42 @@
+"""
+Бенчмарк /operation/check до и после переписывания рендера.
+
+Гоняет одинаковые запросы через baseline (legacy_api_server.py) и через
+текущий api_server на копии settings.json и печатает req/s для обычного
+и AFT-ответа. Запуск из корня пакета:
+
+    python tests/bench_cpa_response.py [число запросов]
+"""
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import conftest  # noqa: F401  (sys.path и временный каталог данных)
+import api_server
+import legacy_api_server
+
+QUERIES = ("/operation/check?o.order_id=1", "/operation/check?o.order_id=1&paymentId=aft")
+
+def main():
+    requests_count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    path = os.path.join(tempfile.mkdtemp(), "settings.json")
+    shutil.copy(os.path.join(conftest.TESTER_DIR, "settings.json"), path)
+    legacy_api_server.SETTINGS_PATH = path
+    api_server.settings_store.path = path
+    for name, app in (("before", legacy_api_server.app), ("after", api_server.app)):
+        client = app.test_client()
+        with contextlib.redirect_stderr(io.StringIO()):
+            for query in QUERIES:
+                started = time.perf_counter()
+                for _ in range(requests_count):
+                    client.get(query)
+                elapsed = time.perf_counter() - started
+                print(f"{name:6} {query:50} {requests_count / elapsed:8.0f} req/s")
+
+if __name__ == "__main__":
+    main()
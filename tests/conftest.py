@@ -0,0 +1,14 @@
+"""
+Общая подготовка тестов: модули tester импортируются как в api_server
+(каталог пакета в sys.path), а файлы данных пишутся во временный
+каталог, чтобы тесты не трогали settings.json и callbacks рядом с кодом.
+"""
+import os
+import sys
+import tempfile
+
+TESTER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault("ECOM_TESTER_DATA_DIR", tempfile.mkdtemp(prefix="ecom-tester-tests-"))
+if TESTER_DIR not in sys.path:
+    sys.path.insert(0, TESTER_DIR)
@@ -0,0 +1,30 @@
+"""
+Проверка AFT-реквизитов совпадает с тем, что шлюз реально отправит в
+mir-extension: телефон в SWIFT проверяется после очистки от пробелов и
+дефисов, как в cpa_response.
+"""
+import pytest
+
+from aft_destinations import SWIFT_TYPE, validate_many
+
+@pytest.mark.parametrize("value", [
+    "ALFABY2X +375 29 123-45-67",
+    "ALFABY2X 375-29-1234567",
+    "ALFABY2X (029) 123.45.67",
+    "ALFABY2X +375291234567",
+    "ALFABY2X",
+])
+def test_formatted_phones_are_accepted(value):
+    [(normalized, phone, error)] = validate_many([value], SWIFT_TYPE)
+    assert normalized == "ALFABY2X"
+    assert error is None
+
+@pytest.mark.parametrize("value", [
+    "ALFABY2X +375 29",
+    "ALFABY2X 1234567890123456",
+    "ALFABY2X call me",
+    "ALFABY2X 375+291234567",
+])
+def test_bad_phones_are_rejected(value):
+    [(_, _, error)] = validate_many([value], SWIFT_TYPE)
+    assert error == "bad phone"
@@ -0,0 +1,54 @@
+"""
+ASGI-шлюз под повторами банка: повторы, ждущие ответа первого запроса,
+не должны останавливать фоновую запись коллбэков, которую этот запрос
+ждет при заполненной очереди.
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import api_server
+import asgi_gateway
+from idempotency import IdempotencyCache
+
+async def call(path, query):
+    messages = []
+
+    async def receive():
+        return {"type": "http.request"}
+
+    async def send(message):
+        messages.append(message)
+
+    await asgi_gateway.app({"type": "http", "path": path, "query_string": query.encode()}, receive, send)
+    return messages[-1]["body"]
+
+def test_retries_do_not_starve_the_callback_writer(monkeypatch):
+    persisted = []
+
+    def slow_persist(items):
+        time.sleep(0.05)
+        persisted.extend(token for token, _ in items)
+
+    monkeypatch.setattr(api_server, "persist_callbacks", slow_persist)
+    monkeypatch.setattr(api_server, "idempotency", IdempotencyCache())
+    writer = asgi_gateway.CallbackWriter(1)
+    monkeypatch.setattr(asgi_gateway, "callback_writer", writer)
+
+    async def scenario():
+        # Маленький общий пул: повторы легко заняли бы его целиком
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(2))
+        await writer.start()
+        requests = [call("/operation/callback", f"trx_id=OTHER{n}&result_code=1") for n in range(3)]
+        requests += [call("/operation/callback", "trx_id=RETRY&result_code=1") for _ in range(8)]
+        started = time.monotonic()
+        bodies = await asyncio.gather(*requests)
+        elapsed = time.monotonic() - started
+        await writer.stop()
+        return bodies, elapsed
+
+    bodies, elapsed = asyncio.run(scenario())
+    assert elapsed < 2
+    assert len(set(bodies)) == 1
+    assert persisted.count("RETRY") == 1
+    assert len(persisted) == 4
@@ -0,0 +1,68 @@
+"""
+Ключ поискового индекса коллбэков: записи различаются по seq журнала,
+а не по (token, timestamp), так что CPAReq и RPReq одной пачки не
+сливаются. Старые базы с ключом по времени переносятся на новый ключ.
+"""
+import sqlite3
+
+import persistence
+from callback_index import CallbackIndex
+
+OLD_SCHEMA = """
+CREATE TABLE callbacks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    seq INTEGER,
+    token TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    type TEXT,
+    order_id TEXT,
+    result_code TEXT,
+    card_id TEXT,
+    payment_system TEXT,
+    record TEXT NOT NULL,
+    UNIQUE (token, timestamp)
+);
+CREATE INDEX callbacks_token ON callbacks (token, id);
+"""
+
+def record(seq, callback_type, token="T1", timestamp="2026-01-01T10:00:00"):
+    return {"seq": seq, "token": token, "timestamp": timestamp,
+            "data": {"type": callback_type, "token": token, "raw_params": {"trx_id": token}}}
+
+def types(index, token="T1"):
+    callbacks, _ = index.search({"token": token})
+    return [callback["data"]["type"] for callback in callbacks]
+
+def test_same_timestamp_records_are_kept(tmp_path):
+    index = CallbackIndex(str(tmp_path / "callbacks.sqlite3"))
+    index.add_many([record(1, "CPAReq"), record(2, "RPReq")])
+    # Повторная индексация тех же записей (например, backfill) их не дублирует
+    index.add_many([record(1, "CPAReq"), record(2, "RPReq")])
+    assert types(index) == ["RPReq", "CPAReq"]
+
+def test_old_unique_key_is_migrated(tmp_path):
+    path = str(tmp_path / "callbacks.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.executescript(OLD_SCHEMA)
+    conn.execute("INSERT INTO callbacks (seq, token, timestamp, type, record) VALUES (1, 'T1', '2026', 'CPAReq', ?)",
+                 ('{"seq": 1, "token": "T1", "timestamp": "2026", "data": {"type": "CPAReq"}}',))
+    conn.commit()
+    conn.close()
+
+    index = CallbackIndex(path)
+    index.add_many([record(2, "RPReq", timestamp="2026")])
+    assert types(index) == ["RPReq", "CPAReq"]
+    assert [row_id for row_id, _ in index.after(0)] == [1, 2]
+    names = {name for name, in index._connect().execute("SELECT name FROM sqlite_master")}
+    assert {"callbacks_token", "callbacks_type", "orders"} <= names
+    assert "callbacks_migrated" not in names
+
+def test_batched_check_and_register_are_both_indexed():
+    # Индекс создается заранее, чтобы первичное наполнение из журнала не
+    # смешалось с проверяемой пачкой
+    persistence.callback_index.search()
+    persistence.save_callbacks([
+        ("BATCH1", {"type": "CPAReq", "raw_params": {"trx_id": "BATCH1"}}),
+        ("BATCH1", {"type": "RPReq", "raw_params": {"trx_id": "BATCH1", "result_code": "1"}}),
+    ])
+    assert types(persistence.callback_index, "BATCH1") == ["RPReq", "CPAReq"]
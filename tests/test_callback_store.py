@@ -0,0 +1,57 @@
+"""
+Компакция журнала коллбэков при недоступном архиве: дозапись не падает,
+вытесненные записи не теряются, временные файлы не остаются.
+"""
+import os
+
+import callback_store
+from callback_store import CallbackStore
+
+def payload(n):
+    return {"type": "CPAReq", "token": f"T{n}", "raw_params": {"trx_id": f"T{n}"}}
+
+def test_archive_failure_does_not_fail_append(tmp_path, monkeypatch):
+    monkeypatch.setattr(callback_store, "COMPACT_SLACK", 5)
+    archived = []
+    failing = [True]
+
+    def archive(records):
+        if failing[0]:
+            raise OSError("archive is read-only")
+        archived.extend(records)
+
+    path = str(tmp_path / "callbacks.jsonl")
+    store = CallbackStore(path, retention=3, on_evict=archive)
+    for n in range(12):
+        record = store.append(f"T{n}", payload(n))
+        assert record["seq"] == n + 1
+
+    # Компакция не прошла: журнал цел, последние записи читаются
+    with open(path) as f:
+        assert len(f.readlines()) == 12
+    assert [record["token"] for record in store.all()] == ["T9", "T10", "T11"]
+    assert os.listdir(tmp_path) == ["callbacks.jsonl"]
+
+    # После восстановления архива компакция забирает все вытесненное
+    failing[0] = False
+    assert store.compact() is True
+    assert [record["token"] for record in archived] == [f"T{n}" for n in range(9)]
+    with open(path) as f:
+        assert len(f.readlines()) == 3
+    assert store.append("T12", payload(12))["seq"] == 13
+    assert sorted(os.listdir(tmp_path)) == ["callbacks.jsonl"]
+
+def test_compaction_error_is_retried_later(tmp_path, monkeypatch):
+    monkeypatch.setattr(callback_store, "COMPACT_SLACK", 0)
+    calls = []
+
+    def archive(records):
+        calls.append(len(records))
+        raise RuntimeError("boom")
+
+    store = CallbackStore(str(tmp_path / "callbacks.jsonl"), retention=1, on_evict=archive)
+    for n in range(10):
+        store.append(f"T{n}", payload(n))
+    # Одна неудачная попытка, дальше ожидание COMPACT_RETRY_DELAY
+    assert calls == [2]
+    assert len(store.all()) == 1
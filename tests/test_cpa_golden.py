@@ -0,0 +1,76 @@
+"""
+Эталонная проверка ответа /operation/check: по матрице настроек и
+параметров запроса новый рендер (шаблоны CompiledResponses) должен
+совпадать байт в байт с baseline-реализацией из legacy_api_server.py.
+"""
+import contextlib
+import io
+import itertools
+import os
+
+import pytest
+
+import api_server
+import legacy_api_server
+
+EXTENSIONS = [
+    {},
+    {"submerchant-data": {"city": "Moscow", "country": "RUS", "id": "SUB1", "name": "N", "terminal-id": "T", "mcc": "1234", "inn": "77"}},
+    {"order-params": [{"name": "card_on_file", "value": "UCOF"}, {"name": "x"}]},
+    {"submerchant-data": {"city": "M"}, "order-params": [{"name": "a", "value": "b"}]},
+]
+TRANSACTION_TYPES = [None, "Payment", "CardRegister", "AFT", "OCT", "P2P", "Bogus"]
+AFT_VALUES = {
+    None: [""],
+    "3ds2.destAbroadPAN": ["BLR4111111111111111", "RUS4111", "4111"],
+    "3ds2.destAbroadIBAN": ["BLRBY86AKBB10100000002966000000", "BY86AKBB"],
+    "3ds2.destAbroadSWIFT": ["ALFABY2X37544781070", "ALFABY2X", "BLRALFABY2X37544781070", "alfa"],
+    "other": ["v"],
+}
+FLAGS = [False, True]
+
+@pytest.fixture(scope="module")
+def settings_path(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("golden") / "settings.json")
+    legacy_path, current_path = legacy_api_server.SETTINGS_PATH, api_server.settings_store.path
+    legacy_api_server.SETTINGS_PATH = path
+    api_server.settings_store.path = path
+    yield path
+    legacy_api_server.SETTINGS_PATH = legacy_path
+    api_server.settings_store.path = current_path
+
+def settings_matrix(extensions, transaction_type):
+    for aft_type, aft_set, recurrent, registration, country, phone in itertools.product(
+            AFT_VALUES, FLAGS, FLAGS, FLAGS, ["", "KAZ"], ["", "+7 999"]):
+        for value in AFT_VALUES[aft_type]:
+            cpa_extensions = dict(extensions)
+            if transaction_type:
+                cpa_extensions["transaction-type"] = transaction_type
+            yield {
+                "amount": 700, "shortDesc": "s", "longDesc": "l", "cpaExtensions": cpa_extensions,
+                "aftEnabled": aft_set, "aftMirExtensionType": aft_type, "aftMirExtensionValue": value,
+                "aftMirExtensionCountry": country, "aftMirExtensionPhone": phone,
+                "recurrentEnabled": recurrent, "selectedCardId": "CARD1", "cardRegistrationEnabled": registration,
+            }
+
+@pytest.mark.parametrize("transaction_type", TRANSACTION_TYPES)
+@pytest.mark.parametrize("extensions", EXTENSIONS)
+def test_check_response_matches_legacy(settings_path, extensions, transaction_type):
+    legacy_client = legacy_api_server.app.test_client()
+    client = api_server.app.test_client()
+    compared = 0
+    for settings in settings_matrix(extensions, transaction_type):
+        api_server.settings_store.save(settings)
+        for query in ("/operation/check?o.order_id=123", "/operation/check?o.order_id=123&paymentId=aft"):
+            with contextlib.redirect_stderr(io.StringIO()):
+                expected = legacy_client.get(query).data
+            assert client.get(query).data == expected, (settings, query)
+            compared += 1
+    assert compared == 704
+
+def test_default_settings_match_legacy(settings_path):
+    if os.path.exists(settings_path):
+        os.unlink(settings_path)
+    with contextlib.redirect_stderr(io.StringIO()):
+        expected = legacy_api_server.app.test_client().get("/operation/check").data
+    assert api_server.app.test_client().get("/operation/check").data == expected
@@ -0,0 +1,81 @@
+"""
+Повторы банка, пришедшие, пока первый запрос еще обрабатывается: коллбэк
+сохраняется один раз, а все повторы получают ответ первого запроса.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from idempotency import IdempotencyCache
+
+ROUTE = "/operation/callback"
+
+def handle(cache, params, persisted, delay=0.05, fail=False):
+    """Обработчик в том же порядке вызовов, что в api_server."""
+    body = cache.lookup(ROUTE, params)
+    if body is None:
+        try:
+            persisted.append(params["trx_id"])
+            time.sleep(delay)
+            if fail:
+                raise RuntimeError("build failed")
+            body = f"response {len(persisted)}"
+            cache.store(ROUTE, params, body)
+        finally:
+            cache.release(ROUTE, params)
+    return body
+
+def test_concurrent_retries_persist_once():
+    cache = IdempotencyCache()
+    persisted = []
+    params = {"trx_id": "T1", "result_code": "1"}
+    with ThreadPoolExecutor(8) as pool:
+        bodies = list(pool.map(lambda _: handle(cache, dict(params), persisted), range(8)))
+    assert persisted == ["T1"]
+    assert set(bodies) == {"response 1"}
+
+def test_failed_owner_hands_over_to_a_retry():
+    cache = IdempotencyCache()
+    persisted = []
+    params = {"trx_id": "T1"}
+    started = threading.Event()
+
+    def failing_owner():
+        cache.lookup(ROUTE, params)
+        started.set()
+        time.sleep(0.05)
+        cache.release(ROUTE, params)
+
+    owner = threading.Thread(target=failing_owner)
+    owner.start()
+    started.wait()
+    began = time.monotonic()
+    assert handle(cache, params, persisted) == "response 1"
+    owner.join()
+    # Повтор проснулся по release, а не по таймауту
+    assert time.monotonic() - began < 1
+    assert persisted == ["T1"]
+
+def test_different_params_do_not_steal_an_in_flight_entry():
+    cache = IdempotencyCache()
+    assert cache.claim(ROUTE, {"trx_id": "T1", "result_code": "1"}) == (None, None)
+    assert cache.claim(ROUTE, {"trx_id": "T1", "result_code": "2"}) == (None, None)
+    cache.store(ROUTE, {"trx_id": "T1", "result_code": "2"}, "failed")
+    cache.store(ROUTE, {"trx_id": "T1", "result_code": "1"}, "ok")
+    assert cache.lookup(ROUTE, {"trx_id": "T1", "result_code": "1"}) == "ok"
+
+def test_fingerprint_ignores_parameter_order():
+    cache = IdempotencyCache()
+    first = {"trx_id": "T1", "a": "1", "b": "2"}
+    second = {"b": "2", "a": "1", "trx_id": "T1"}
+    assert cache._fingerprint(first) == cache._fingerprint(second)
+    assert cache._fingerprint(first) != cache._fingerprint(dict(first, b="3"))
+    cache.store(ROUTE, first, "body")
+    assert cache.lookup(ROUTE, second) == "body"
+
+def test_disabled_cache_never_claims():
+    cache = IdempotencyCache(ttl=0)
+    assert cache.claim(ROUTE, {"trx_id": "T1"}) == (None, None)
+    cache.store(ROUTE, {"trx_id": "T1"}, "body")
+    assert cache.lookup(ROUTE, {"trx_id": "T1"}) is None
+    assert len(cache) == 0
@@ -0,0 +1,38 @@
+"""
+Бюджет времени импорта: шлюз импортирует persistence при старте, а не на
+каждый запрос, и persistence не должен тянуть Flask и blueprint tester.
+Время меряется через python -X importtime в отдельном процессе, чтобы не
+зависеть от уже загруженных в pytest модулей.
+"""
+import os
+import subprocess
+import sys
+
+from conftest import TESTER_DIR
+
+# Бюджеты с запасом на медленные CI-машины, микросекунды
+PERSISTENCE_BUDGET_US = 150000
+API_SERVER_BUDGET_US = 1500000
+
+def import_times(statement):
+    """Накопленное время импорта (мкс) по модулям верхнего уровня и вывод процесса."""
+    env = dict(os.environ, PYTHONPATH=TESTER_DIR)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", statement],
+                            capture_output=True, text=True, env=env, cwd=TESTER_DIR, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit() and not name.startswith("  "):
+            times[name.strip()] = int(cumulative)
+    return times, result.stdout
+
+def test_persistence_import_is_light():
+    times, output = import_times("import sys, persistence; print('flask' in sys.modules)")
+    assert output.strip() == "False"
+    assert times["persistence"] < PERSISTENCE_BUDGET_US
+
+def test_api_server_import_budget():
+    times, _ = import_times("import api_server")
+    assert times["api_server"] < API_SERVER_BUDGET_US
@@ -0,0 +1,93 @@
+"""
+LifecycleTracker считает воронку по индексу, а не по событиям своего
+процесса: трекер другого воркера или после перезапуска видит то же самое.
+"""
+from callback_index import CallbackIndex
+from lifecycle import LifecycleTracker
+
+def callback(seq, callback_type, trx_id, timestamp, **params):
+    params.update({"trx_id": trx_id})
+    return {"seq": seq, "token": trx_id, "timestamp": timestamp,
+            "data": {"type": callback_type, "token": trx_id, "raw_params": params}}
+
+def test_counts_are_shared_between_trackers(tmp_path):
+    index = CallbackIndex(str(tmp_path / "callbacks.sqlite3"))
+    index.add_orders([1, 2, 3])
+    index.add_orders([3])
+    index.add_many([
+        callback(1, "CPAReq", "T1", "2026-01-01T10:00:00", **{"o.order_id": "1"}),
+        callback(2, "RPReq", "T1", "2026-01-01T10:00:02", result_code="1"),
+        callback(3, "CPAReq", "T2", "2026-01-01T10:00:03", **{"o.order_id": "2"}),
+    ])
+
+    worker = LifecycleTracker()
+    worker.sync(index)
+    restarted = LifecycleTracker()
+    restarted.sync(index)
+
+    for tracker in (worker, restarted):
+        stats = tracker.stats()
+        assert stats["reached"] == {"created": 3, "checked": 2, "registered": 1, "success": 1, "fail": 0}
+        assert stats["conversion"]["checked"] == 2 / 3
+        assert stats["in_flight"] == 2
+        assert stats["latency"]["count"] == 1
+
+def test_order_indexed_after_its_callback_is_still_created(tmp_path):
+    index = CallbackIndex(str(tmp_path / "callbacks.sqlite3"))
+    tracker = LifecycleTracker()
+    index.add_many([callback(1, "CPAReq", "T1", "2026-01-01T10:00:00", **{"o.order_id": "7"})])
+    tracker.sync(index)
+    index.add_orders([7])
+    tracker.sync(index)
+    stats = tracker.stats()
+    assert stats["reached"]["created"] == 1
+    assert stats["reached"]["checked"] == 1
+    assert stats["duplicates"] == 0
+
+def assert_ratios_bounded(stats):
+    for name, ratio in stats["conversion"].items():
+        assert ratio is None or 0 <= ratio <= 1, (name, ratio)
+
+def test_uncreated_order_does_not_inflate_conversion(tmp_path):
+    index = CallbackIndex(str(tmp_path / "callbacks.sqlite3"))
+    index.add_orders([1])
+    index.add_many([
+        callback(1, "CPAReq", "T1", "2026-01-01T10:00:00", **{"o.order_id": "1"}),
+        callback(2, "CPAReq", "T99", "2026-01-01T10:00:01", **{"o.order_id": "99"}),
+    ])
+    tracker = LifecycleTracker()
+    tracker.sync(index)
+    stats = tracker.stats()
+    assert stats["reached"]["created"] == 1
+    assert stats["reached"]["checked"] == 2
+    assert stats["conversion"]["checked"] == 1.0
+    assert_ratios_bounded(stats)
+
+def test_register_only_flow_does_not_inflate_conversion(tmp_path):
+    index = CallbackIndex(str(tmp_path / "callbacks.sqlite3"))
+    index.add_orders([1])
+    index.add_many([
+        callback(1, "CPAReq", "T1", "2026-01-01T10:00:00", **{"o.order_id": "1"}),
+        callback(2, "RPReq", "T2", "2026-01-01T10:00:01", result_code="1"),
+        callback(3, "RPReq", "T3", "2026-01-01T10:00:02", result_code="2"),
+    ])
+    tracker = LifecycleTracker()
+    tracker.sync(index)
+    stats = tracker.stats()
+    assert stats["reached"]["registered"] == 2
+    assert stats["conversion"]["registered"] == 0.0
+    assert stats["conversion"]["success"] == 0.5
+    assert_ratios_bounded(stats)
+
+def test_flow_evicted_before_register_is_not_converted(tmp_path):
+    index = CallbackIndex(str(tmp_path / "callbacks.sqlite3"))
+    index.add_orders([1, 2, 3])
+    index.add_many([
+        callback(1, "CPAReq", "T1", "2026-01-01T10:00:00", **{"o.order_id": "1"}),
+        callback(2, "CPAReq", "T2", "2026-01-01T10:00:01", **{"o.order_id": "2"}),
+        callback(3, "CPAReq", "T3", "2026-01-01T10:00:02", **{"o.order_id": "3"}),
+        callback(4, "RPReq", "T1", "2026-01-01T10:00:03", result_code="1"),
+    ])
+    tracker = LifecycleTracker(capacity=2)
+    tracker.sync(index)
+    assert_ratios_bounded(tracker.stats())
@@ -0,0 +1,29 @@
+"""
+Каждый круг нагрузочного прогона идет с новыми trx_id и номерами
+заказов, иначе шлюз отвечал бы на него из кэша повторов.
+"""
+from loadtest import CALLBACK_PATH, CHECK_PATH, cycle_ids, synthesize_traffic
+
+def test_cycles_get_unique_ids():
+    traffic = synthesize_traffic(120, seed=1)
+    rewrite = cycle_ids(traffic)
+    seen = set()
+    for cycle in range(3):
+        for path, params in traffic:
+            rewritten = rewrite(params, cycle)
+            if path == CHECK_PATH:
+                seen.add((rewritten["trx_id"], rewritten["o.order_id"]))
+            else:
+                assert rewritten["merchant_trx"] == rewritten["o.order_id"]
+    assert len(seen) == 3 * 120
+    assert len({order_id for _, order_id in seen}) == 3 * 120
+
+def test_pairs_stay_matched_and_first_cycle_is_untouched():
+    traffic = [(CHECK_PATH, {"trx_id": "T", "o.order_id": "ABC"}),
+               (CALLBACK_PATH, {"trx_id": "T", "o.order_id": "ABC", "result_code": "1"})]
+    rewrite = cycle_ids(traffic)
+    assert rewrite(traffic[0][1], 0) is traffic[0][1]
+    check, callback = (rewrite(params, 2) for _, params in traffic)
+    assert check["trx_id"] == callback["trx_id"] == "T-2"
+    assert check["o.order_id"] == callback["o.order_id"] == "ABC-2"
+    assert traffic[0][1]["trx_id"] == "T"
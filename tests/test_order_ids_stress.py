@@ -0,0 +1,59 @@
+"""
+Нагрузочная проверка OrderIdAllocator: несколько процессов одновременно
+берут номера из одного order_counter.txt. Номера не должны повторяться,
+а пропуски допустимы только как брошенные остатки блоков.
+"""
+import multiprocessing
+import os
+from array import array
+
+from order_ids import OrderIdAllocator
+
+PROCESSES = 4
+TOTAL = int(os.environ.get("ORDER_IDS_STRESS_TOTAL", "1000000"))
+BLOCK_SIZE = 1000
+# Каждый процесс берет не кратное блоку число номеров, чтобы остаток
+# последнего блока пропадал
+PER_PROCESS = TOTAL // PROCESSES - BLOCK_SIZE // 3
+
+def allocate(counter_path, output_path, count):
+    allocator = OrderIdAllocator(counter_path, BLOCK_SIZE)
+    ids = array("q", (allocator.next_id() for _ in range(count)))
+    with open(output_path, "wb") as f:
+        ids.tofile(f)
+
+def test_concurrent_allocators_never_repeat(tmp_path):
+    counter_path = str(tmp_path / "order_counter.txt")
+    context = multiprocessing.get_context("fork")
+    outputs = [str(tmp_path / f"ids_{i}.bin") for i in range(PROCESSES)]
+    workers = [context.Process(target=allocate, args=(counter_path, output, PER_PROCESS)) for output in outputs]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+
+    allocated = array("q")
+    for output in outputs:
+        with open(output, "rb") as f:
+            allocated.frombytes(f.read())
+    assert len(allocated) == PROCESSES * PER_PROCESS
+    unique = set(allocated)
+    assert len(unique) == len(allocated)
+
+    with open(counter_path) as f:
+        counter = int(f.read())
+    assert min(unique) >= 1 and max(unique) <= counter
+    # Пропадает только хвост последнего блока каждого процесса
+    abandoned = counter - len(unique)
+    assert abandoned == PROCESSES * (-PER_PROCESS % BLOCK_SIZE)
+
+def test_reserve_ranges_do_not_overlap_with_blocks(tmp_path):
+    counter_path = str(tmp_path / "order_counter.txt")
+    allocator = OrderIdAllocator(counter_path, 20)
+    other = OrderIdAllocator(counter_path, 20)
+    first = allocator.next_id()
+    batch = other.reserve(100)
+    assert list(batch) == list(range(21, 121))
+    assert [allocator.next_id() for _ in range(19)] == list(range(first + 1, 21))
+    assert allocator.next_id() == 121
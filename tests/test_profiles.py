@@ -0,0 +1,71 @@
+"""
+Выбор профиля по диапазонам номеров заказа, в том числе вложенным и
+пересекающимся.
+"""
+import pytest
+
+import profiles
+from profiles import DEFAULT_PROFILE, ProfileRouter
+
+@pytest.fixture(autouse=True, params=["direct", "bisect"])
+def lookup(request, monkeypatch):
+    # Оба способа поиска по диапазонам должны давать один результат
+    if request.param == "bisect":
+        monkeypatch.setattr(profiles, "DIRECT_LOOKUP_LIMIT", 0)
+    return request.param
+
+class StaticSettings:
+    def __init__(self, settings):
+        self.settings = settings
+
+    def snapshot(self):
+        return self.settings, 1
+
+def router(ranges):
+    settings = {
+        "amount": 100,
+        "profiles": {"outer": {"amount": 1}, "inner": {"amount": 2}, "deep": {"amount": 3}, "other": {"amount": 4}},
+        "profileRouting": {"orderRanges": ranges},
+    }
+    return ProfileRouter(StaticSettings(settings))
+
+def resolve(router, order_id):
+    return router.resolve({"o.order_id": str(order_id)})
+
+@pytest.mark.parametrize("order_id, expected", [
+    (999, DEFAULT_PROFILE), (1000, "outer"), (1499, "outer"), (1500, "inner"), (1550, "deep"),
+    (1560, "inner"), (1599, "inner"), (1600, "outer"), (1999, "outer"), (2000, DEFAULT_PROFILE),
+])
+def test_nested_ranges_resolve_to_innermost(order_id, expected):
+    nested = router([
+        {"from": 1500, "to": 1599, "profile": "inner"},
+        {"from": 1000, "to": 1999, "profile": "outer"},
+        {"from": 1550, "to": 1559, "profile": "deep"},
+    ])
+    assert resolve(nested, order_id) == expected
+
+def test_overlapping_ranges_prefer_narrower_then_earlier():
+    overlapping = router([
+        {"from": 100, "to": 199, "profile": "outer"},
+        {"from": 150, "to": 249, "profile": "other"},
+        {"from": 180, "to": 189, "profile": "inner"},
+    ])
+    assert [resolve(overlapping, n) for n in (120, 160, 185, 195, 240, 250)] == \
+        ["outer", "outer", "inner", "outer", "other", DEFAULT_PROFILE]
+
+def test_unknown_profile_falls_back_to_enclosing_range():
+    fallback = router([
+        {"from": 1, "to": 100, "profile": "outer"},
+        {"from": 10, "to": 20, "profile": "missing"},
+        {"from": "x", "to": 5, "profile": "inner"},
+    ])
+    assert resolve(fallback, 15) == "outer"
+    assert resolve(fallback, "abc") == DEFAULT_PROFILE
+
+def test_direct_table_only_for_compact_ranges(lookup):
+    compact = router([{"from": 1000, "to": 1999, "profile": "outer"}])
+    sparse = router([{"from": 1, "to": 10, "profile": "outer"}, {"from": 10 ** 9, "to": 10 ** 9, "profile": "inner"}])
+    assert (compact.table()[5] is not None) == (lookup == "direct")
+    assert sparse.table()[5] is None
+    assert resolve(sparse, 10 ** 9) == "inner"
+    assert resolve(sparse, 11) == DEFAULT_PROFILE
@@ -0,0 +1,19 @@
+"""
+Перекрывающиеся SamplingProfiler не должны оставлять интервал
+переключения GIL заниженным после остановки последнего из них.
+"""
+import sys
+
+import pytest
+
+from metrics import SamplingProfiler
+
+@pytest.mark.parametrize("stop_order", [(0, 1), (1, 0)])
+def test_overlapping_profilers_restore_switch_interval(stop_order):
+    original = sys.getswitchinterval()
+    profilers = [SamplingProfiler().start(), SamplingProfiler(interval=0.0005).start()]
+    assert sys.getswitchinterval() < original
+    profilers[stop_order[0]].stop()
+    assert sys.getswitchinterval() < original
+    profilers[stop_order[1]].stop()
+    assert sys.getswitchinterval() == original
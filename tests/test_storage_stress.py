@@ -0,0 +1,107 @@
+"""
+Несколько процессов одновременно пишут коллбэки, настройки и карты в
+общие файлы - как api_server и воркеры tester. Ни одна запись не должна
+потеряться или оказаться оборванной.
+"""
+import json
+import multiprocessing
+import os
+
+from callback_archive import CallbackArchive
+from callback_index import CallbackIndex
+from callback_store import CallbackStore
+from card_registry import CardRegistry
+from settings_store import SettingsStore
+
+PROCESSES = 4
+CALLBACKS_PER_PROCESS = 600
+SETTINGS_PER_PROCESS = 100
+CARDS_PER_PROCESS = 50
+RETENTION = 50
+
+def callback(worker, n, callback_type):
+    token = f"W{worker}-{n}"
+    return token, {"type": callback_type, "token": token, "raw_params": {"trx_id": token, "o.order_id": str(n)}}
+
+def write_callbacks(paths, worker):
+    archive = CallbackArchive(paths["archive"])
+    store = CallbackStore(paths["log"], RETENTION, on_evict=archive.append)
+    index = CallbackIndex(paths["index"])
+    for n in range(CALLBACKS_PER_PROCESS):
+        # CPAReq и RPReq одной операции уходят одной пачкой
+        batch = [callback(worker, n, "CPAReq"), callback(worker, n, "RPReq")]
+        index.add_many(store.append_many(batch))
+
+def write_settings(paths, worker):
+    store = SettingsStore(paths["settings"], {})
+    for n in range(SETTINGS_PER_PROCESS):
+        store.save({"worker": worker, "n": n, "padding": "x" * 4096})
+        with open(paths["settings"], encoding="utf-8") as f:
+            settings = json.load(f)
+        assert set(settings) == {"worker", "n", "padding"}
+
+def write_cards(paths, worker):
+    registry = CardRegistry(paths["cards"], capacity=PROCESSES * CARDS_PER_PROCESS, flush_delay=0.001)
+    for n in range(CARDS_PER_PROCESS):
+        registry.add({"card_id": f"C{worker}-{n}", "masked_pan": f"4111{worker}{n:04d}", "payment_system": "VISA"})
+    registry.flush()
+
+def work(paths, worker):
+    write_callbacks(paths, worker)
+    write_settings(paths, worker)
+    write_cards(paths, worker)
+
+def test_concurrent_writers_lose_nothing(tmp_path):
+    paths = {
+        "log": str(tmp_path / "callbacks.jsonl"),
+        "index": str(tmp_path / "callbacks.sqlite3"),
+        "archive": str(tmp_path / "archive"),
+        "settings": str(tmp_path / "settings.json"),
+        "cards": str(tmp_path / "cards.json"),
+    }
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=work, args=(paths, worker)) for worker in range(PROCESSES)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+
+    expected = {(f"W{worker}-{n}", callback_type) for worker in range(PROCESSES)
+                for n in range(CALLBACKS_PER_PROCESS) for callback_type in ("CPAReq", "RPReq")}
+
+    # Журнал и архив вместе: каждая запись ровно один раз, без обрывов
+    with open(paths["log"], "rb") as f:
+        lines = f.read().split(b"\n")
+    assert lines.pop() == b""
+    live = [json.loads(line) for line in lines]
+    archived = list(CallbackArchive(paths["archive"]).records())
+    assert archived and len(live) < len(expected)
+    stored = [(record["token"], record["data"]["type"]) for record in archived + live]
+    assert len(stored) == len(expected)
+    assert set(stored) == expected
+    seqs = sorted(record["seq"] for record in archived + live)
+    assert seqs == list(range(1, len(expected) + 1))
+
+    # Индекс хранит всю историю
+    index = CallbackIndex(paths["index"])
+    indexed = []
+    cursor = 0
+    while True:
+        rows = index.after(cursor)
+        if not rows:
+            break
+        indexed.extend((record["token"], record["data"]["type"]) for _, record in rows)
+        cursor = rows[-1][0]
+    assert len(indexed) == len(expected)
+    assert set(indexed) == expected
+
+    with open(paths["settings"], encoding="utf-8") as f:
+        settings = json.load(f)
+    assert settings["n"] == SETTINGS_PER_PROCESS - 1
+
+    with open(paths["cards"], encoding="utf-8") as f:
+        cards = json.load(f)
+    assert {card["card_id"] for card in cards} == {
+        f"C{worker}-{n}" for worker in range(PROCESSES) for n in range(CARDS_PER_PROCESS)}
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
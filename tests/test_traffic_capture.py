@@ -0,0 +1,49 @@
+"""
+Файл захвата, который дописывают несколько процессов: каждый gzip-член
+начинается со снимка настроек своего процесса.
+"""
+from traffic_capture import CaptureRecorder, read_capture
+
+def exchange(n):
+    return {"time": n, "path": "/operation/check", "method": "GET", "query": f"o.order_id={n}",
+            "status": 200, "response": str(n)}
+
+def applied_settings(path):
+    """Номер обмена -> настройки, которые replay применил бы перед ним."""
+    current = None
+    seen = {}
+    for entry in read_capture(path):
+        if entry["kind"] == "settings":
+            current = entry["settings"]
+        else:
+            seen[entry["time"]] = current
+    return seen
+
+def test_interleaved_members_carry_their_settings(tmp_path):
+    path = str(tmp_path / "capture.jsonl.gz")
+    first = CaptureRecorder(path, flush_delay=60)
+    second = CaptureRecorder(path, flush_delay=60)
+    a, b, c = {"amount": 1}, {"amount": 2}, {"amount": 3}
+
+    first.record(exchange(1), a, 1)
+    first.flush()
+    second.record(exchange(2), b, 7)
+    second.flush()
+    # Настройки первого процесса не менялись, но перед его членом уже
+    # записан чужой снимок
+    first.record(exchange(3), a, 1)
+    first.record(exchange(4), c, 2)
+    first.flush()
+    second.record(exchange(5), b, 7)
+    second.flush()
+
+    assert applied_settings(path) == {1: a, 2: b, 3: a, 4: c, 5: b}
+
+def test_settings_are_not_repeated_within_a_member(tmp_path):
+    path = str(tmp_path / "capture.jsonl.gz")
+    recorder = CaptureRecorder(path, flush_delay=60)
+    for n in range(3):
+        recorder.record(exchange(n), {"amount": 1}, 1)
+    recorder.flush()
+    kinds = [entry["kind"] for entry in read_capture(path)]
+    assert kinds == ["settings", "request", "request", "request"]
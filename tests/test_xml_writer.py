@@ -0,0 +1,78 @@
+"""
+XmlWriter и собранные им расширения CPA: документ разбирается
+стандартным парсером, текст экранируется, а раскладка для обычных
+значений совпадает с baseline-сборкой строк.
+"""
+import contextlib
+import io
+import xml.etree.ElementTree as ET
+
+import pytest
+
+import legacy_api_server
+from cpa_response import build_cpa_extensions_xml
+from xml_writer import XmlWriter
+
+SPECIAL = "A&B <c> \"d\" 'e'"
+
+def parse_fragment(fragment):
+    return ET.fromstring(f"<root>{fragment}</root>")
+
+def test_nested_layout_round_trips():
+    writer = XmlWriter()
+    writer.open("a")
+    writer.element("b", 1)
+    writer.open("c", inline=True)
+    writer.element("d", "x")
+    writer.element("e", "y")
+    writer.close()
+    writer.close()
+    assert writer.getvalue() == "<a>\n  <b>1</b>\n  <c><d>x</d><e>y</e></c>\n</a>"
+    root = ET.fromstring(writer.getvalue())
+    assert [child.tag for child in root] == ["b", "c"]
+    assert root.find("c/e").text == "y"
+
+def test_special_characters_are_escaped():
+    writer = XmlWriter()
+    writer.open("a")
+    writer.element("b", SPECIAL)
+    writer.close()
+    assert "&amp;" in writer.getvalue() and "&lt;c&gt;" in writer.getvalue()
+    assert ET.fromstring(writer.getvalue()).find("b").text == SPECIAL
+
+def test_control_characters_are_dropped():
+    writer = XmlWriter()
+    writer.element("b", "x\x00y\x07z\x1b\ttab\nline")
+    assert ET.fromstring(writer.getvalue()).text == "xyz\ttab\nline"
+
+def test_extensions_with_special_values_parse():
+    extensions = {
+        "submerchant-data": {"city": SPECIAL, "name": "\x01Shop\x02"},
+        "order-params": [{"name": "n<1>", "value": SPECIAL}],
+        "transaction-type": "Payment",
+    }
+    root = parse_fragment(build_cpa_extensions_xml(extensions))
+    assert root.find("submerchant-data/city").text == SPECIAL
+    assert root.find("submerchant-data/name").text == "Shop"
+    assert root.find("order-params/param/name").text == "n<1>"
+    assert root.find("order-params/param/value").text == SPECIAL
+    assert root.find("transaction-type").text == "Payment"
+
+@pytest.mark.parametrize("extensions", [
+    {},
+    {"submerchant-data": {"city": "Moscow", "country": "RUS", "id": "SUB1", "name": "N", "terminal-id": "T", "mcc": "1234", "inn": "77"}},
+    {"order-params": [{"name": "card_on_file", "value": "UCOF"}, {"name": "x"}, "skip"], "transaction-type": "OCT"},
+    {"submerchant-data": {"city": "M"}, "order-params": [{"name": "a", "value": "b"}], "transaction-type": "Bogus"},
+])
+@pytest.mark.parametrize("aft", [
+    (False, None, None, None, None),
+    (True, "3ds2.destAbroadPAN", "BLR4111111111111111", "", ""),
+    (True, "3ds2.destAbroadIBAN", "BY86AKBB10100000002966000000", "BLR", ""),
+    (True, "3ds2.destAbroadSWIFT", "ALFABY2X37544781070", "", "+7 999"),
+    (True, "other", "v", "KAZ", ""),
+])
+def test_matches_legacy_builder(extensions, aft):
+    with contextlib.redirect_stderr(io.StringIO()):
+        expected = legacy_api_server.build_cpa_extensions_xml(extensions, *aft)
+    assert build_cpa_extensions_xml(extensions, *aft) == expected
+    parse_fragment(expected)
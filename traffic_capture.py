@@ -0,0 +1,82 @@
+"""
+Запись трафика шлюза для последующего воспроизведения (replay.py).
+
+Каждый обмен (запрос банка и наш ответ) - одна строка JSON. Строки
+копятся в памяти и раз в flush_delay секунд (или по batch_size штук)
+дописываются в файл отдельным gzip-членом под flock. Такой файл только
+растет, его могут дописывать несколько процессов, а gzip.open читает
+все члены подряд как один поток.
+
+Каждый gzip-член начинается со снимка настроек, с которыми обработан
+его первый обмен, а после смены настроек внутри члена пишется новый
+снимок. Члены разных процессов в файле перемежаются, поэтому снимок
+только при смене версии в своем процессе не годится: replay применил бы
+к обменам одного процесса настройки, записанные другим.
+"""
+import atexit
+import fcntl
+import gzip
+import json
+import threading
+import zlib
+
+class CaptureRecorder:
+    def __init__(self, path, flush_delay=1.0, batch_size=500):
+        self.path = path
+        self.flush_delay = flush_delay
+        self.batch_size = batch_size
+        self._pending = []
+        self._settings_version = None
+        self._settings_line = None
+        self._timer = None
+        self._lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def record(self, entry, settings=None, settings_version=None):
+        """
+        Ставит в очередь запись обмена. settings/settings_version -
+        настройки, с которыми он обработан; снимок пишется при их смене
+        и в начале каждого gzip-члена.
+        """
+        with self._lock:
+            if settings_version is not None and settings_version != self._settings_version:
+                self._settings_line = json.dumps({"kind": "settings", "settings": settings}, ensure_ascii=False)
+                self._settings_version = settings_version
+                self._pending.append(self._settings_line)
+            elif not self._pending and self._settings_line is not None:
+                self._pending.append(self._settings_line)
+            self._pending.append(json.dumps(dict(entry, kind="request"), ensure_ascii=False))
+            if len(self._pending) >= self.batch_size:
+                flush_now = True
+            else:
+                flush_now = False
+                if self._timer is None:
+                    self._timer = threading.Timer(self.flush_delay, self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+        if flush_now:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            lines, self._pending = self._pending, []
+        if not lines:
+            return
+        member = gzip.compress(("\n".join(lines) + "\n").encode("utf-8"))
+        with open(self.path, "ab") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.write(member)
+
+def read_capture(path):
+    """Записи файла захвата по порядку. Оборванный хвост пропускается."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        except (EOFError, zlib.error, gzip.BadGzipFile):
+            # Процесс упал посреди записи последнего gzip-члена
+            return
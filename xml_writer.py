@@ -0,0 +1,70 @@
+"""
+Потоковая запись XML для ответов шлюза.
+
+Куски пишутся в один список и склеиваются один раз в getvalue(), так
+что стоимость каждого элемента постоянна, а весь документ собирается
+за линейное время. Текст и значения экранируются при записи. Отступы
+ставятся сразу при записи элемента: глубина задается явно, потому что
+раскладка ответов банку историческая и не везде совпадает с глубиной
+вложенности.
+
+Управляющие символы, запрещенные в XML 1.0 (кроме табуляции и переводов
+строки), выбрасываются из текста: их нельзя записать даже ссылкой на
+символ, и парсер банка отверг бы весь ответ.
+
+Элемент, открытый с inline=True, пишет все свое содержимое в одну
+строку - так выводятся submerchant-data и order-params.
+"""
+import re
+from xml.sax.saxutils import escape
+
+INDENT = "  "
+
+INVALID_XML_CHARS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]")
+
+def escape_text(text):
+    """Текст элемента: экранирует &, <, > и убирает недопустимые символы."""
+    return escape(INVALID_XML_CHARS.sub("", str(text)))
+
+class XmlWriter:
+    def __init__(self, indent=INDENT):
+        self.indent = indent
+        self._parts = []
+        # (имя, глубина, inline, были ли дочерние элементы)
+        self._stack = []
+
+    def _inline(self):
+        return bool(self._stack) and self._stack[-1][2]
+
+    def _begin(self, depth):
+        if self._stack:
+            self._stack[-1][3] = True
+        if depth is None:
+            depth = len(self._stack)
+        # Перенос строки перед элементом, кроме самого начала документа
+        if not self._inline() and self._parts:
+            self._parts.append("\n" + self.indent * depth)
+        return depth
+
+    def raw(self, text):
+        """Пишет готовый фрагмент без экранирования."""
+        self._parts.append(text)
+
+    def open(self, name, depth=None, inline=False):
+        depth = self._begin(depth)
+        self._parts.append(f"<{name}>")
+        self._stack.append([name, depth, inline or self._inline(), False])
+
+    def close(self):
+        name, depth, inline, has_children = self._stack.pop()
+        if has_children and not inline:
+            self._parts.append("\n" + self.indent * depth)
+        self._parts.append(f"</{name}>")
+
+    def element(self, name, text, depth=None):
+        """Элемент с текстом: <name>text</name>."""
+        self._begin(depth)
+        self._parts.append(f"<{name}>{escape_text(text)}</{name}>")
+
+    def getvalue(self):
+        return "".join(self._parts)